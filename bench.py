@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""Benchmarks for semicolon cogs."""
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Set up logging
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+log = logging.getLogger('bench')
+log.setLevel(logging.INFO)
+
+
+HELLO = ('++++++++[>++++[>++>+++>+++>+<<<<-]>+>+>->>+[<]<-]>>.>---.+++++++..+++.>>.<-.<.+++.------.--------.'
+         '>>+.>++.')
+# name:(language, code, input) mapping of esolang workloads
+ESOLANG_WORKLOADS = {
+    'bf_hello': ('bf', HELLO, ''),
+    'bf_nested': ('bf', '++++++++[>++++++++[>++++++++[>+>+<<-]>>[<<+>>-]<<<-]<-]', ''),
+    'bf_tape': ('bf', '-[>-]', ''),
+    'bf_output': ('bf', '++++++++[>++++++++<-]>+[.]', ''),
+    'bf_input': ('bf', ',[.,]', 'semicolon ' * 5000),
+    'stbf_hello': ('stbf', HELLO, ''),
+    'stbf_stack': ('stbf', '++++++++[>++++++++<-]>[)=$-]', ''),
+    'stbf_input': ('stbf', ',[)(.,]', 'semicolon ' * 5000),
+}
+
+
+# Synthetic languages, only their letter frequencies differ: name:random seed mapping
+CIPHER_LANGUAGES = {'english': 1, 'french': 2, 'german': 3}
+KEY = 'SEMICOLON'
+ALPHABET = 'QWERTYUIOPASDFGHJKLZXCVBNM'
+# name:(prepare, run) mapping of cipher workloads, `prepare` turns plain text into the input of `run`
+CIPHER_WORKLOADS = {
+    'rot': (None, lambda cipher, text: cipher.encode_rot(text, 13)),
+    'atbash': (None, lambda cipher, text: cipher.atbash(text)),
+    'rot7879': (None, lambda cipher, text: cipher.encode_7879(text)),
+    'vigenere': (None, lambda cipher, text: cipher.encode_vigenere(text, KEY)),
+    'vigenere_decode': (lambda cipher, text: cipher.encode_vigenere(text, KEY),
+                        lambda cipher, text: cipher.encode_vigenere(text, KEY, reverse=True)),
+    'substitute': (None, lambda cipher, text: cipher.encode_substitute(ALPHABET, text)),
+    'mixed': (None, lambda cipher, text: cipher.encode_mixed_alphabet(KEY, text)),
+    'morse': (None, lambda cipher, text: cipher.encode_morse(text)),
+    'morse_decode': (lambda cipher, text: cipher.encode_morse(text),
+                     lambda cipher, text: cipher.encode_morse(text, reverse=True)),
+    'tap_code': (None, lambda cipher, text: cipher.encode_tap_code(text)),
+    'tap_code_decode': (lambda cipher, text: cipher.encode_tap_code(text),
+                        lambda cipher, text: cipher.encode_tap_code(text, reverse=True)),
+    'box': (None, lambda cipher, text: cipher.encode_cipher_box(text)),
+    'analyze_frequency': (None, lambda cipher, text: cipher.analyze_frequency(text)),
+    'caesar_detect': (lambda cipher, text: cipher.encode_rot(text, 7), lambda cipher, text: cipher.caesar(0, text, '')),
+    'language': (None, lambda cipher, text: cipher.language(text)),
+}
+
+
+def language_weights(seed):
+    """Letter weights of a synthetic language."""
+    generator = random.Random(seed)
+    return [generator.random() ** 3 for _ in string.ascii_uppercase]
+
+
+def synthetic_text(size, seed=0):
+    """Generate `size` characters of text in a synthetic language: words, spaces and punctuation."""
+    generator = random.Random(seed)
+    weights = language_weights(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = ''.join(generator.choices(string.ascii_lowercase, weights, k=generator.randint(1, 9)))
+        if generator.random() < 0.1:
+            word = word.capitalize()
+        if generator.random() < 0.05:
+            word += generator.choice(',.!?')
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def write_ngrams(path, lengths):
+    """Write ngram files of synthetic languages to a folder, for each ngram length in `lengths`."""
+    names = {2: 'bigrams', 3: 'trigrams', 4: 'quadgrams'}
+    for lang, seed in CIPHER_LANGUAGES.items():
+        letters = ''.join(char for char in synthetic_text(200000, seed).upper() if char in string.ascii_uppercase)
+        for length in lengths:
+            counts = collections.Counter(letters[i:i + length] for i in range(len(letters) - length + 1))
+            with open(os.path.join(path, '%s_%s.txt' % (lang, names[length])), 'w') as file:
+                for ngram, count in counts.most_common():
+                    file.write('%s %d\n' % (ngram, count))
+
+
+def measure(func, repeat):
+    """Call a function `repeat` times, return its last result and the best wall time."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def peak_memory(func):
+    """Call a function once, return the peak memory allocated during the call, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_esolang(args):
+    """Measure esolang interpreters throughput."""
+    import cogs.esolang as esolang
+    # Run programs until they end or reach the tick limit, whatever the time it takes
+    esolang.MAX_TICK = args.ticks
+    esolang.MAX_TIME = float('inf')
+    esolang.MAX_SIZE = args.size
+    results = []
+    for name, (language, code, word) in ESOLANG_WORKLOADS.items():
+        if args.workloads and name not in args.workloads:
+            continue
+
+        def run():
+            return esolang.execute(language, code, word)
+
+        (output, state, message, ticks, _), seconds = measure(run, args.repeat)
+        results.append({'workload': name, 'language': language, 'ticks': ticks, 'seconds': seconds,
+                        'ticks_per_second': ticks / seconds if seconds else None,
+                        'peak_memory': peak_memory(run), 'output_size': len(output), 'state': state})
+        log.info('%-12s %9d ticks %8.4fs %12.0f ticks/s %9d B peak', name, ticks, seconds,
+                 results[-1]['ticks_per_second'] or 0, results[-1]['peak_memory'])
+    return results
+
+
+def bench_cipher(args):
+    """Measure cipher functions and text analysis throughput."""
+    import cogs.cipher as cipher
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        # Ngram files are not distributed, use synthetic ones
+        write_ngrams(path, [2, 3, 4] if args.fitness else [2])
+        cipher.NGRAMS_PATH = path + os.sep
+        cipher.NGRAMS_CACHE_PATH = os.path.join(path, 'cache') + os.sep
+        start = time.perf_counter()
+        cipher.cog.on_init()
+        log.info('Loaded ngrams in %.4fs', time.perf_counter() - start)
+        for size in args.sizes or [80, 4096, 65536, 262144]:
+            plain = synthetic_text(size, CIPHER_LANGUAGES['english'])
+            for name, (prepare, run) in CIPHER_WORKLOADS.items():
+                if args.workloads and name not in args.workloads:
+                    continue
+                text = plain if prepare is None else prepare(cipher, plain)
+
+                def call():
+                    return run(cipher, text)
+
+                _, seconds = measure(call, args.repeat)
+                results.append({'workload': name, 'size': size, 'input_size': len(text), 'seconds': seconds,
+                                'chars_per_second': len(text) / seconds if seconds else None,
+                                'peak_memory': peak_memory(call)})
+                log.info('%-18s %8d chars %8.4fs %14.0f chars/s %10d B peak', name, len(text), seconds,
+                         results[-1]['chars_per_second'] or 0, results[-1]['peak_memory'])
+    return results
+
+
+COMMANDS = {'esolang': bench_esolang, 'cipher': bench_cipher}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run semicolon benchmarks')
+    parser.add_argument('-o', '--output', action='store', metavar='file',
+                        help='write results as JSON to a file (- for standard output)')
+    parser.add_argument('-r', '--repeat', action='store', type=int, default=3,
+                        help='number of runs per workload, the best time is kept')
+    sub = parser.add_subparsers(dest='command')
+
+    parser_esolang = sub.add_parser('esolang', help='Benchmark esoteric languages interpreters')
+    parser_esolang.add_argument('-t', '--ticks', action='store', type=int, default=2000000,
+                                help='tick limit for each program')
+    parser_esolang.add_argument('-s', '--size', action='store', type=int, default=100000,
+                                help='output size limit for each program')
+    parser_esolang.add_argument('workloads', nargs='*', help='workloads to run (default: all)')
+
+    parser_cipher = sub.add_parser('cipher', help='Benchmark ciphers and text analysis')
+    parser_cipher.add_argument('-s', '--size', action='append', type=int, dest='sizes', metavar='size',
+                               help='input size, in characters, can be repeated (default: 80, 4096, 65536, 262144)')
+    parser_cipher.add_argument('-f', '--fitness', action='store_true',
+                               help='also generate trigram and quadgram data, used for fitness scoring')
+    parser_cipher.add_argument('workloads', nargs='*', help='workloads to run (default: all)')
+
+    args = parser.parse_args()
+    if args.command is None:
+        log.error('Expected a command, use --help for more information')
+        return
+
+    results = COMMANDS[args.command](args)
+    if args.output:
+        data = {'command': args.command, 'python': sys.version.split()[0], 'results': results}
+        if args.output == '-':
+            json.dump(data, sys.stdout, indent=2)
+        else:
+            with open(args.output, 'w') as file:
+                json.dump(data, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
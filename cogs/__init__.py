@@ -9,6 +9,10 @@ class Wrapper:
         self.cogs = {}       # name:module mapping of properly loaded cogs
         self.fail = set()    # names of cogs that failed to load
         self.no_cog = {}     # name:module mapping of properly loaded cogs that don't have `cog`
+        self.index = {}      # alias:[(name, Cog)] mapping of all commands, rebuilt on load/reload
+        self.version = 0     # incremented every time the index is rebuilt
+        self.views = {}      # guild_id:(version, guild version, alias:[(name, Cog)]) per-guild filtered indexes
+        self.events = {}     # event:[(Cog, gearbox.Event)] mapping of event handlers, event names without `on_`
 
     def load(self, name):
         """Load a cog given its name (file name without extension)."""
@@ -38,6 +42,7 @@ class Wrapper:
         mod.cog.on_init()
         self.log.info("Loaded cog '%s'.", name)
         self.cogs[name] = mod
+        self.update_index()
 
     def reload(self, name, mod):  # Passing name for logging purposes
         """Reload a cog."""
@@ -59,6 +64,33 @@ class Wrapper:
         mod.cog.load_cfg()
         mod.cog.on_init()
         mod.cog.subcogs = subcogs
+        self.update_index()
+
+    def update_index(self):
+        """Rebuild the alias index and event table, must be called whenever `self.cogs` changes."""
+        index = {}
+        events = {}
+        for name, mod in self.cogs.items():
+            for alias in mod.cog.aliases:
+                index.setdefault(alias, []).append((name, mod.cog))
+            for method, event in mod.cog.events.items():
+                if method.startswith('on_'):
+                    events.setdefault(method[3:], []).append((mod.cog, event))
+        self.index = index
+        self.events = events
+        self.version += 1
+        self.views = {}
+
+    def view(self, guild_ex):
+        """Return the alias index restricted to the cogs allowed on a guild.
+
+        The view is filled lazily, one alias at a time, and dropped when either
+        the index or the guild settings change."""
+        cached = self.views.get(guild_ex.id)
+        if cached is None or cached[0] != self.version or cached[1] != guild_ex.version:
+            cached = (self.version, guild_ex.version, {})
+            self.views[guild_ex.id] = cached
+        return cached[2]
 
     def cog(self, name):
         """Return a Cog object given its name."""
@@ -68,11 +100,19 @@ class Wrapper:
 
     def command(self, cmd, guild_ex=None, permissions=None):
         """Find a command given its name."""
-        allowed = guild_ex.is_allowed if guild_ex is not None else (lambda _: True)
+        if guild_ex is None:
+            entries = self.index.get(cmd, ())
+        else:
+            view = self.view(guild_ex)
+            entries = view.get(cmd)
+            if entries is None:
+                entries = [(name, _cog) for name, _cog in self.index.get(cmd, ()) if guild_ex.is_allowed(name)]
+                view[cmd] = entries
         matches = []
-        for name, _cog in self.cogs.items():
-            if allowed(name) and _cog.cog.has(cmd, permissions):
-                matches.append((name, _cog.cog.get(cmd, permissions)))
+        for name, _cog in entries:
+            command = _cog.get(cmd, permissions)
+            if command is not None:
+                matches.append((name, command))
         return matches
 
     def __iter__(self):
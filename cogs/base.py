@@ -200,3 +200,13 @@ def info():
         name=';;', author='Zeroji', link='https://github.com/Zeroji/semicolon/releases/latest',
         ver=ver, pver=pver, dver=discord.__version__, hostname=socket.gethostname()
     )
+
+
+@cog.command
+def pools():
+    """Display the usage of the pools running slow commands."""
+    if not gearbox.EXECUTOR_STATS:
+        return _('No command has been run in a pool yet.')
+    return '\n'.join([_('{name}: {workers} workers, {pending} pending, {peak} at most, {done} done').format(
+        name=name, workers=gearbox.CFG['executor'][name], **stats)
+        for name, stats in sorted(gearbox.EXECUTOR_STATS.items())])
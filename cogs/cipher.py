@@ -1,79 +1,517 @@
 """Cipher cog for semicolon."""
+import array
+import binascii
+import collections
+import collections.abc
+import functools
+import hashlib
+import io
 import math
+import mmap
 import random
+import re
 import string
+import struct
+import tempfile
+import time
+import unittest
+import unittest.mock
+import discord
 import gearbox
 import os
+try:
+    import numpy
+except ImportError:  # Vectorized analysis is optional
+    numpy = None
 cog = gearbox.Cog()
 _ = cog.gettext
 
+
+class TestCipher(unittest.TestCase):
+    TEXT = ('It was the best of times, it was the worst of times, it was the age of wisdom, it was the age of '
+            'foolishness, it was the epoch of belief, it was the epoch of incredulity, it was the season of '
+            'Light, it was the season of Darkness, it was the spring of hope, it was the winter of despair.')
+
+    def test_substitute(self):
+        self.assertEqual(encode_substitute('QWERTYUIOPASDFGHJKLZXCVBNM', 'Hello, World!'), 'Itssg, Vgksr!')
+        self.assertEqual(encode_substitute('QWERTYUIOPASDFGHJKLZXCVBNM', 'Itssg', True), 'Hello')
+        # Letters out of a short alphabet are left unchanged
+        self.assertEqual(encode_substitute('ABC', 'abcd'), 'abcd')
+        self.assertEqual(encode_mixed_alphabet('HELLO', 'abc', True), 'fgh')
+
+    def test_token_codec(self):
+        decoder = MorseDecoder()
+        # A token split between chunks is buffered, even across an empty chunk
+        self.assertEqual(decoder.feed('.- .'), 'A')
+        self.assertEqual(decoder.feed(''), '')
+        self.assertEqual(decoder.feed('.'), '')
+        self.assertEqual(decoder.finish(), 'I')
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_crack_vigenere(self):
+        cipher = encode_vigenere(self.TEXT, 'LEMON')
+        self.assertEqual(crack_vigenere(cipher), 'LEMON')
+        key, text = cipher.split(None, 1)
+        self.assertEqual(vigenere(key, text, 'c'), '`LEMON` ' + self.TEXT)
+        self.assertEqual(crack_vigenere('A'), None)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_analyze_rotations(self):
+        ranks = {'en': {ngram: rank for rank, ngram in enumerate(['TH', 'HE', 'IN', 'ER', 'AN', 'RE', 'ON', 'AT'])},
+                 'fr': {ngram: rank for rank, ngram in enumerate(['ES', 'DE', 'LE', 'EN', 'ON', 'NT', 'RE'])}}
+        arrays = {}
+        for lang, bigrams in ranks.items():
+            array = numpy.full(26 * 26, -1)
+            for ngram, rank in bigrams.items():
+                array[bigram_index(ngram)] = rank
+            arrays[lang] = (array, len(bigrams))
+        with unittest.mock.patch.dict(RANKS, ranks, clear=True), \
+                unittest.mock.patch.dict(RANK_ARRAYS, arrays, clear=True):
+            for text in (self.TEXT, encode_rot(self.TEXT, 7), 'Les enfants de la lune', 'ab ab ba', 'a', '',
+                         '1234, !?'):
+                self.assertEqual(analyze_rotations(text),
+                                 [analyze_frequency(encode_rot(text, offset)) for offset in range(26)], text)
+
+    def test_crack_substitution(self):
+        plain = self.TEXT
+        letters = letter_codes(plain)
+        counts = collections.Counter([letters[i:i + 4] for i in range(len(letters) - 3)])
+        alphabet = list(string.ascii_uppercase)
+        random.Random(19).shuffle(alphabet)
+        cipher = encode_substitute(''.join(alphabet), plain)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'english_quadgrams.txt')
+            with open(path, 'w') as file:
+                file.writelines(['%s %d\n' % (bytes([code + 65 for code in ngram]).decode(), count)
+                                 for ngram, count in counts.items()])
+            for vectorized in (True, False):
+                with unittest.mock.patch(__name__ + '.numpy', numpy if vectorized else None):
+                    random.seed(19)
+                    fitness, key = crack_substitution(cipher, DenseTable(DenseTable.compile(path)), 0.5)
+                    self.assertEqual(encode_substitute(key, cipher), plain)
+
+    def test_frequencies(self):
+        data = self.TEXT.encode()
+        words = [word for word in re.split('[^A-Z]+', self.TEXT.upper()) if word]
+        for vectorized in (True, False):
+            with unittest.mock.patch(__name__ + '.numpy', numpy if vectorized else None):
+                whole = Frequencies()
+                whole.feed(data)
+                for length in Frequencies.LENGTHS:
+                    expected = collections.Counter([word[i:i + length] for word in words
+                                                    for i in range(len(word) - length + 1)])
+                    self.assertEqual(dict(whole.top(length, 26 ** length)), expected)
+                # Chunks as small as one byte split ngrams between two or three chunks
+                for size in (1, 2, 3, 7):
+                    split = Frequencies()
+                    for chunk in chunks(data, size):
+                        split.feed(chunk)
+                    for length in Frequencies.LENGTHS:
+                        self.assertEqual(split.top(length, 26 ** length), whole.top(length, 26 ** length))
+                        self.assertEqual(split.total(length), whole.total(length))
+
+    def test_ngram_table(self):
+        counts = {'TH': 50, 'HE': 30, 'IN': 12, 'ER': 8}
+        with tempfile.TemporaryDirectory() as folder, \
+                unittest.mock.patch(__name__ + '.NGRAMS_PATH', os.path.join(folder, 'ngrams', '')), \
+                unittest.mock.patch(__name__ + '.NGRAMS_CACHE_PATH', os.path.join(folder, 'cache', '')):
+            os.mkdir(NGRAMS_PATH)
+            with open(NGRAMS_PATH + 'english_bigrams.txt', 'w') as file:
+                file.writelines(['%s %d\n' % item for item in counts.items()])
+            built = load_table('english_bigrams.txt')
+            cache = NGRAMS_CACHE_PATH + 'english_bigrams.bin'
+            self.assertTrue(os.path.isfile(cache))
+            # The second load maps the cache file, which holds the same table
+            loaded = load_table('english_bigrams.txt')
+            self.assertIsInstance(loaded.buffer, mmap.mmap)
+            for table in (built, loaded):
+                self.assertEqual(dict(table.items()), {ngram: count / 100 for ngram, count in counts.items()})
+                self.assertEqual(table.first(2), ['TH', 'HE'])
+                self.assertEqual(table['IN'], 0.12)
+                self.assertNotIn('XX', table)
+            # The cache is rebuilt when the source file changes, or when it is invalid
+            with open(NGRAMS_PATH + 'english_bigrams.txt', 'a') as file:
+                file.write('AN 100\n')
+            self.assertEqual(load_table('english_bigrams.txt').first(2), ['AN', 'TH'])
+            with open(cache, 'r+b') as file:
+                file.write(b'JUNK')
+            self.assertEqual(load_table('english_bigrams.txt')['AN'], 0.5)
+            self.assertIsInstance(load_table('english_bigrams.txt').buffer, mmap.mmap)
+
+    def test_dense_table(self):
+        counts = {'THE': 60, 'AND': 30, 'ING': 10}
+        with tempfile.TemporaryDirectory() as folder, \
+                unittest.mock.patch(__name__ + '.NGRAMS_PATH', os.path.join(folder, 'ngrams', '')), \
+                unittest.mock.patch(__name__ + '.NGRAMS_CACHE_PATH', os.path.join(folder, 'cache', '')):
+            os.mkdir(NGRAMS_PATH)
+            with open(NGRAMS_PATH + 'english_trigrams.txt', 'w') as file:
+                file.writelines(['%s %d\n' % item for item in counts.items()])
+            built = load_table('english_trigrams.txt', DenseTable)
+            loaded = load_table('english_trigrams.txt', DenseTable)
+            self.assertIsInstance(loaded.buffer, mmap.mmap)
+            floor = math.log10(0.01 / 100)
+            for table in (built, loaded):
+                self.assertEqual((table.length, table.count), (3, 26 ** 3))
+                self.assertAlmostEqual(table.probabilities[(19 * 26 + 7) * 26 + 4], math.log10(0.6), places=6)
+                self.assertAlmostEqual(table.probabilities[0], floor, places=6)
+                for vectorized in (True, False):
+                    with unittest.mock.patch(__name__ + '.numpy', numpy if vectorized else None):
+                        # THE, HEA and EAN (absent), AND
+                        self.assertAlmostEqual(table.fitness('The, and!'),
+                                               (math.log10(0.6) + 2 * floor + math.log10(0.3)) / 4, places=5)
+                        self.assertIsNone(table.fitness('an'))
+            with unittest.mock.patch.dict(DENSE, {'english': {3: loaded}}, clear=True):
+                self.assertAlmostEqual(ngram_fitness('the', 'english'), math.log10(0.6), places=6)
+                self.assertIsNone(ngram_fitness('the', 'english', 4))
+                self.assertIsNone(ngram_fitness('the', 'french'))
+                # Texts too short for the longest ngrams are scored with shorter ones
+                with open(NGRAMS_PATH + 'english_quadgrams.txt', 'w') as file:
+                    file.write('THEN 1\n')
+                DENSE['english'][4] = load_table('english_quadgrams.txt', DenseTable)
+                self.assertEqual(ngram_fitness('then', 'english'), 0)
+                self.assertAlmostEqual(ngram_fitness('the', 'english'), math.log10(0.6), places=6)
+
+    def test_hash(self):
+        data = b'The quick brown fox jumps over the lazy dog'
+        self.assertEqual(digest('md5', chunks(data)), '9e107d9d372bb6826bd81d3542a419d6')
+        self.assertEqual(digest('sha256', chunks(data, 5)), hashlib.sha256(data).hexdigest())
+
+    def test_base(self):
+        self.assertEqual(convert_base('256', '2', 'Hi'), '01001000 01101001')
+        self.assertEqual(convert_base('2', '10', '0100 1000 01101001'), '72 105')
+        self.assertEqual(convert_base('10', '16', '72 105'), '4869')
+        self.assertEqual(convert_base('16', '64', '48 69'), 'SGk=')
+        self.assertEqual(convert_base('64', '256', 'SGk='), 'Hi')
+        # Invalid digits, signs, separators, incomplete bytes and out of range values are rejected
+        for source, text in (('2', '-0000001'), ('2', '+0000001'), ('2', '0000_0001'), ('2', '0100100'),
+                             ('10', '-1'), ('10', '+72'), ('10', '256'), ('16', '4g'), ('16', '486'),
+                             ('64', 'SG*k='), ('64', 'S=Gk'), ('64', 'SGk')):
+            self.assertIsNone(convert_base(source, '16', text), (source, text))
+
+
 BIGRAMS = {}
+RANKS = {}  # language:{ngram:rank} mapping of the most frequent bigrams of each language
+RANK_ARRAYS = {}  # language:(array, length) mapping, `RANKS` as arrays indexed by ASCII bigram, -1 if absent
+UNIGRAMS = {}  # language:array mapping of ASCII letter frequencies, derived from bigrams
+DENSE = {}  # language:{length:DenseTable} mapping of trigram and quadgram tables
+DENSE_FILES = {'trigrams': 3, 'quadgrams': 4}
+TOP_NGRAMS = 40  # Number of most frequent ngrams compared by `analyze_frequency`
+MAX_KEY_LENGTH = 20  # Longest Vigenere key tried when cracking
+SUBS_TIME = 3.0  # Time, in seconds, spent searching for a substitution alphabet
+HASHES = {'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512'}
+BASES = {'2', '10', '16', '64', '256'}
+CHUNK_SIZE = 1 << 16  # Size of the chunks fed to hash functions and base converters, in bytes
+OFFLOAD_SIZE = 1 << 16  # Inputs larger than this are processed in the thread pool, in bytes
+MAX_OUTPUT = 1900  # Longest output sent as a message
+BINARY = [format(byte, '08b') for byte in range(256)]
+# base:pattern mapping of valid inputs, checked before decoding (conversions accept signs, `_` or invalid characters)
+BASE_PATTERNS = {'2': re.compile('[01]*'), '10': re.compile(r'[0-9\s]*'), '16': re.compile('[0-9A-Fa-f]*'),
+                 '64': re.compile('[A-Za-z0-9+/]*={0,2}')}
+TOP_FREQUENCIES = 10  # Number of most frequent letters, bigrams and trigrams displayed by `freq`
+# Frequencies of letters in English, used to crack Vigenere when no ngram data is available
+ENGLISH = (8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+           6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074)
 NGRAMS_PATH = 'data/cipher.ngrams/'
+NGRAMS_CACHE_PATH = 'data/cipher.cache/'
+# Cache files start with a magic string, the ngram length and count, then the source file's mtime (ns) and size
+CACHE_HEADER = struct.Struct('=4sIIqq4x')
+CACHE_MAGIC = b'NGR1'
+DENSE_MAGIC = b'NGD1'
+NON_LETTERS = bytes(set(range(256)) - set(string.ascii_uppercase.encode()))
+
+
+class NgramTable(collections.abc.Mapping):
+    """Read-only ngram:frequency mapping stored in a binary buffer, usually memory-mapped.
+
+    After the header, the buffer contains ngrams as arrays of codepoints (right-padded with zeros),
+    then their frequencies as doubles, in native byte order. Ngrams are sorted by decreasing
+    frequency, ties broken like `first_ngrams`, so the first ngrams are the most frequent."""
+
+    def __init__(self, buffer):
+        """Initialize from a buffer, raise ValueError if it is not a valid table."""
+        if len(buffer) < CACHE_HEADER.size:
+            raise ValueError('Truncated ngram table')
+        magic, self.length, self.count, self.mtime, self.size = CACHE_HEADER.unpack_from(buffer)
+        start = CACHE_HEADER.size
+        end = start + self.length * self.count * 4
+        offset = end + -end % 8  # Align frequencies
+        if magic != CACHE_MAGIC or len(buffer) < offset + self.count * 8:
+            raise ValueError('Invalid ngram table')
+        self.buffer = buffer
+        view = memoryview(buffer)
+        self.codepoints = view[start:end].cast('I')
+        self.frequencies = view[offset:offset + self.count * 8].cast('d')
+        self.index = None  # ngram:position mapping, built on the first lookup
+
+    @staticmethod
+    def compile(path, mtime=0, size=0):
+        """Parse a ngram text file and return its table as bytes."""
+        # Files contain one ngram per line, followed by a space then its count
+        frequencies = {}
+        lines = open(path).read().splitlines()
+        total = sum([int(line.split()[1]) for line in lines])
+        for line in lines:
+            ngram, freq = line.split()
+            frequencies[ngram.upper()] = float(freq) / total
+        ngrams = sorted([(freq, ngram) for ngram, freq in frequencies.items()], reverse=True)
+        length = max([len(ngram) for freq, ngram in ngrams], default=0)
+        codepoints = array.array('I', [ord(char) for freq, ngram in ngrams for char in ngram.ljust(length, '\0')])
+        data = bytearray(CACHE_HEADER.pack(CACHE_MAGIC, length, len(ngrams), mtime, size))
+        data += codepoints.tobytes()
+        data += bytes(-len(data) % 8)
+        data += array.array('d', [freq for freq, ngram in ngrams]).tobytes()
+        return bytes(data)
+
+    def ngram(self, position):
+        """Return the ngram at a position."""
+        start = position * self.length
+        return ''.join(map(chr, self.codepoints[start:start + self.length])).rstrip('\0')
+
+    def first(self, count):
+        """Return the `count` most frequent ngrams."""
+        return [self.ngram(position) for position in range(min(count, self.count))]
+
+    def items(self):
+        """Return (ngram, frequency) pairs, most frequent first."""
+        return zip(self, self.frequencies)
+
+    def __getitem__(self, ngram):
+        if self.index is None:
+            self.index = {ngram: position for position, ngram in enumerate(self)}
+        return self.frequencies[self.index[ngram]]
+
+    def __iter__(self):
+        return map(self.ngram, range(self.count))
+
+    def __len__(self):
+        return self.count
+
+
+def letter_codes(message):
+    """Return the ASCII letters of a message as bytes, from 0 (A) to 25 (Z)."""
+    return bytes([code - ord('A') for code in message.upper().encode('ascii', 'ignore').translate(None, NON_LETTERS)])
+
+
+class DenseTable:
+    """Log10 probabilities of all ASCII ngrams of a given length, stored in a binary buffer.
+
+    After the header, the buffer contains 26^length floats in native byte order; the ngram
+    with letter codes (a, b, c) is at index (a * 26 + b) * 26 + c. Absent ngrams get a floor value."""
+
+    def __init__(self, buffer):
+        """Initialize from a buffer, raise ValueError if it is not a valid table."""
+        if len(buffer) < CACHE_HEADER.size:
+            raise ValueError('Truncated ngram table')
+        magic, self.length, self.count, self.mtime, self.size = CACHE_HEADER.unpack_from(buffer)
+        if magic != DENSE_MAGIC or self.count != 26 ** self.length or \
+                len(buffer) < CACHE_HEADER.size + self.count * 4:
+            raise ValueError('Invalid ngram table')
+        self.buffer = buffer
+        self.probabilities = memoryview(buffer)[CACHE_HEADER.size:CACHE_HEADER.size + self.count * 4].cast('f')
+        if numpy is not None:
+            self.array = numpy.frombuffer(self.probabilities, dtype=numpy.float32)
+
+    @staticmethod
+    def compile(path, mtime=0, size=0):
+        """Parse a ngram text file and return its table as bytes."""
+        lines = [line.split() for line in open(path).read().splitlines()]
+        total = sum([int(count) for ngram, count in lines])
+        length = max([len(ngram) for ngram, count in lines], default=0)
+        probabilities = array.array('f', [math.log10(0.01 / total)]) * 26 ** length
+        for ngram, count in lines:
+            codes = letter_codes(ngram)
+            if len(codes) == length:
+                probabilities[functools.reduce(lambda index, code: index * 26 + code, codes)] = \
+                    math.log10(int(count) / total)
+        return CACHE_HEADER.pack(DENSE_MAGIC, length, len(probabilities), mtime, size) + probabilities.tobytes()
+
+    def fitness(self, message):
+        """Return the average log10 probability of the ngrams of a message, or None if it is too short."""
+        codes = letter_codes(message)
+        count = len(codes) - self.length + 1
+        if count < 1:
+            return None
+        if numpy is not None:
+            codes = numpy.frombuffer(codes, dtype=numpy.uint8).astype(numpy.intp)
+            indexes = codes[:count].copy()
+            for i in range(1, self.length):
+                indexes *= 26
+                indexes += codes[i:i + count]
+            return float(self.array[indexes].mean())
+        total = 0
+        modulo = 26 ** self.length
+        index = functools.reduce(lambda index, code: index * 26 + code, codes[:self.length - 1], 0)
+        for code in codes[self.length - 1:]:
+            index = (index * 26 + code) % modulo
+            total += self.probabilities[index]
+        return total / count
+
+
+def load_table(name, table=NgramTable):
+    """Load a ngram file through its binary cache, rebuilding the cache if the file changed.
+
+    `table` is the class of the returned table, NgramTable or DenseTable."""
+    source = os.stat(NGRAMS_PATH + name)
+    cache = NGRAMS_CACHE_PATH + os.path.splitext(name)[0] + '.bin'
+    try:
+        with open(cache, 'rb') as file:
+            result = table(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        if (result.mtime, result.size) == (source.st_mtime_ns, source.st_size):
+            return result
+    except (OSError, ValueError):  # Missing, empty or invalid cache
+        pass
+    data = table.compile(NGRAMS_PATH + name, source.st_mtime_ns, source.st_size)
+    try:
+        os.makedirs(NGRAMS_CACHE_PATH, exist_ok=True)
+        # Other processes may be reading the cache, replace it atomically
+        temp = '%s.%d' % (cache, os.getpid())
+        with open(temp, 'wb') as file:
+            file.write(data)
+        os.replace(temp, cache)
+    except OSError:  # The cache is only an optimization
+        pass
+    return table(data)
 
 
 @cog.init
 def load_files():
-    """Load bigram files."""
+    """Load ngram files."""
     if not os.path.exists(NGRAMS_PATH):
         return
 
     # Files are text files named `language_bigrams.txt` in folder `data/cipher.ngrams`
     # They contain one ngram per line, followed by a space then its count or frequency
     # Example: `EN 4569` then `ER 1532`
-    global BIGRAMS
+    # Files named `language_trigrams.txt` and `language_quadgrams.txt` are used for fitness scoring
+    # They are compiled into memory-mapped binary files in folder `data/cipher.cache`
+    for file in os.listdir(NGRAMS_PATH):
+        kind = os.path.splitext(file)[0].split('_')[-1]
+        if kind in DENSE_FILES:
+            table = load_table(file, DenseTable)
+            if table.length == DENSE_FILES[kind]:
+                DENSE.setdefault(file.split('_')[0].lower(), {})[table.length] = table
     files = [name for name in os.listdir(NGRAMS_PATH) if 'bigrams' in name]
     for file in files:
-        lines = open(NGRAMS_PATH + file).read().splitlines()
-        total = sum([int(line.split()[1]) for line in lines])
         lang = file.split('_')[0].lower()
-        BIGRAMS[lang] = {}
-        for line in lines:
-            ngram, freq = line.split()
-            BIGRAMS[lang][ngram.upper()] = float(freq) / total
+        BIGRAMS[lang] = load_table(file)
+        RANKS[lang] = {ngram: rank for rank, ngram in enumerate(BIGRAMS[lang].first(TOP_NGRAMS))}
+        if numpy is not None:
+            ranks = numpy.full(26 * 26, -1)
+            for ngram, rank in RANKS[lang].items():
+                if len(ngram) == 2 and ngram.isascii() and ngram.isalpha():
+                    ranks[bigram_index(ngram)] = rank
+            RANK_ARRAYS[lang] = (ranks, len(RANKS[lang]))
+            letters = numpy.zeros(26)
+            for ngram, freq in BIGRAMS[lang].items():
+                if len(ngram) == 2 and ngram.isascii() and ngram.isalpha():
+                    letters[ord(ngram[0]) - ord('A')] += freq
+            if letters.any():
+                UNIGRAMS[lang] = letters / letters.sum()
+
+
+def bigram_index(ngram):
+    """Index of an uppercase ASCII bigram in a flattened 26x26 matrix."""
+    return (ord(ngram[0]) - ord('A')) * 26 + ord(ngram[1]) - ord('A')
+
+
+def first_ngrams(freq_dict, count):
+    """Sort a ngram dictionary and return the 'count' most frequent items."""
+    freq_list = [(freq, ngram) for ngram, freq in freq_dict.items()]
+    freq_list.sort(reverse=True)
+    return [ngram for freq, ngram in freq_list[:count]]
+
+
+def out_of_place(ranks, sample):
+    """Calculate the out-of-place score of a sample text against a target.
+
+    ranks:  ngram:rank mapping of the target
+    sample: ngrams of the sample, most frequent first"""
+    distance = 0
+    for index, ngram in enumerate(sample):
+        rank = ranks.get(ngram)
+        err = len(ranks) if rank is None else abs(index - rank)
+        distance += (len(ranks) - index) * err
+    return distance
 
 
 def analyze_frequency(message):
     """Analyze bigram frequency of a message to detect its language.
 
     Return a sorted list of (score, language) tuples, lower score means higher probability."""
-
-    def first_ngrams(freq_dict, count):
-        """Sort a ngram dictionary and return the 'count' most frequent items."""
-        freq_list = [(freq, ngram) for ngram, freq in freq_dict.items()]
-        freq_list.sort(reverse=True)
-        return [ngram for freq, ngram in freq_list[:count]]
-
-    def out_of_place(target, sample):
-        """Calculate the out-of-place score of a sample text against a target."""
-        distance = 0
-        for index, ngram in enumerate(sample):
-            try:
-                err = abs(index - target.index(ngram))
-            except ValueError:
-                err = len(target)
-            distance += (len(target) - index) * err
-        return distance
-
-    bigrams = {}
-    bi_count = 0
-    for i, char in enumerate(message):
-        if char.lower() != char.upper():  # Keep only letters
-            char = char.upper()
-            if i + 1 < len(message):
-                char2 = message[i+1].upper()
-                if char2.lower() != char2.upper():
-                    bigrams[char + char2] = bigrams.get(char + char2, 0) + 1
-                    bi_count += 1
-    for bigram in bigrams:
-        bigrams[bigram] /= bi_count
+    # Uppercase letters, anything else is None and breaks bigrams
+    letters = [char if char.lower() != char.upper() else None for char in message.upper()]
+    # Counts are not normalized, this wouldn't change their order
+    bigrams = collections.Counter([first + second for first, second in zip(letters, letters[1:])
+                                   if first is not None and second is not None])
     distances = []
-    first_bigrams = first_ngrams(bigrams, 40)
-    for lang, frequencies in BIGRAMS.items():
-        distances.append((out_of_place(first_ngrams(frequencies, 40), first_bigrams), lang))
+    first_bigrams = first_ngrams(bigrams, TOP_NGRAMS)
+    for lang, ranks in RANKS.items():
+        distances.append((out_of_place(ranks, first_bigrams), lang))
     distances.sort()
     return distances
 
 
+def analyze_rotations(message):
+    """Analyze the bigram frequency of all 26 rotations of an ASCII message, using NumPy.
+
+    Return a list of `analyze_frequency(encode_rot(message, offset))` for each offset."""
+    codes = numpy.frombuffer(message.upper().encode('ascii'), dtype=numpy.uint8).astype(numpy.intp) - ord('A')
+    letters = (codes >= 0) & (codes < 26)
+    pairs = letters[:-1] & letters[1:]
+    counts = numpy.bincount(codes[:-1][pairs] * 26 + codes[1:][pairs], minlength=26 * 26)
+
+    # Rotating a text by `offset` moves the count of bigram (a, b) to (a + offset, b + offset)
+    offsets = numpy.arange(26)[:, None, None]
+    first, second = numpy.divmod(numpy.arange(26 * 26), 26)
+    rotated = counts[(first - offsets) % 26 * 26 + (second - offsets) % 26].reshape(26, 26 * 26)
+
+    # Most frequent bigrams of each rotation, ties broken like `first_ngrams` (last bigram first)
+    indexes = numpy.broadcast_to(numpy.arange(26 * 26), rotated.shape)
+    order = numpy.lexsort((-indexes, -rotated), axis=-1)
+    top = order[:, :min(TOP_NGRAMS, numpy.count_nonzero(counts))]
+
+    # Out-of-place distance of every rotation against every language
+    positions = numpy.arange(top.shape[1])
+    distances = [[] for _ in range(26)]
+    for lang, (ranks, length) in RANK_ARRAYS.items():
+        found = ranks[top]
+        err = numpy.where(found < 0, length, numpy.abs(positions - found))
+        for offset, distance in enumerate(((length - positions) * err).sum(axis=1).tolist()):
+            distances[offset].append((distance, lang))
+    for scores in distances:
+        scores.sort()
+    return distances
+
+
+def ngram_fitness(message, lang, length=None):
+    """Return the average log10 probability of the ngrams of a message in a language.
+
+    Use the longest ngrams available unless `length` is given, falling back to shorter ones
+    if the message is too short. Return None if there is no data for this language and length,
+    or if the message has too few letters."""
+    tables = DENSE.get(lang, {})
+    for table_length in sorted(tables, reverse=True) if length is None else [length]:
+        table = tables.get(table_length)
+        fitness = None if table is None else table.fitness(message)
+        if fitness is not None:
+            return fitness
+    return None
+
+
+def analyze_fitness(message):
+    """Score the ngram fitness of a message in each language with trigram or quadgram data.
+
+    Return a sorted list of (score, language) tuples like `analyze_frequency`, lower score means
+    higher probability. The list is empty if there is no data or the message is too short."""
+    scores = []
+    for lang in DENSE:
+        fitness = ngram_fitness(message, lang)
+        if fitness is not None:
+            scores.append((-fitness, lang))
+    scores.sort()
+    return scores
+
+
 def shift(letter, number):
     """Shift a letter by a numeric offset."""
     if 'A' <= letter <= 'Z':
@@ -83,15 +521,134 @@ def shift(letter, number):
     return letter  # If it's not a letter don't change it
 
 
+def substitution_table(source, alphabet):
+    """Build a translation table replacing each letter of `source` by the letter at the same index in `alphabet`.
+
+    Both alphabets are uppercase, lowercase letters are replaced by their lowercase counterpart."""
+    table = dict(zip(source, alphabet))
+    table.update(zip(source.lower(), alphabet.lower()))
+    return str.maketrans(table)
+
+
+# Translation tables of ROT0 to ROT25
+ROT_TABLES = [substitution_table(string.ascii_uppercase, string.ascii_uppercase[i:] + string.ascii_uppercase[:i])
+              for i in range(26)]
+ATBASH_TABLE = substitution_table(string.ascii_uppercase, string.ascii_uppercase[::-1])
+LETTER_RUNS = re.compile('([A-Za-z]+)')
+
+
+class Codec:
+    """Incremental encoder or decoder.
+
+    Text is given in chunks to `feed`, which returns the output available so far,
+    then `finish` returns the rest of the output. State is kept between chunks,
+    so text can be processed in bounded memory."""
+
+    def feed(self, chunk):
+        """Process a chunk of text, return the output available so far."""
+        raise NotImplementedError
+
+    def finish(self):
+        """Return the remaining output once all text has been given."""
+        return ''
+
+    def process(self, text):
+        """Process a whole text at once."""
+        return self.feed(text) + self.finish()
+
+
+class TranslationCodec(Codec):
+    """Codec replacing characters one by one, using a `str.translate` table."""
+
+    def __init__(self, table):
+        """Initialization."""
+        self.table = table
+
+    def feed(self, chunk):
+        return chunk.translate(self.table)
+
+
+class RotCodec(TranslationCodec):
+    """Caesar's ROT cipher."""
+
+    def __init__(self, offset, reverse=False):
+        """Initialization."""
+        super().__init__(ROT_TABLES[(-offset if reverse else offset) % 26])
+
+
+class AtbashCodec(TranslationCodec):
+    """Atbash cipher, its own inverse."""
+
+    def __init__(self):
+        """Initialization."""
+        super().__init__(ATBASH_TABLE)
+
+
+class SubstitutionCodec(TranslationCodec):
+    """Alphabet substitution."""
+
+    def __init__(self, alphabet, reverse=False):
+        """Initialization."""
+        super().__init__(substitute_table(alphabet, reverse))
+
+
+class VigenereCodec(Codec):
+    """Vigenere cipher, the key only advances on letters."""
+
+    def __init__(self, key, reverse=False):
+        """Initialization."""
+        self.tables = [ROT_TABLES[(-1 if reverse else 1) * (ord(char) - ord('A')) % 26] for char in key.upper()]
+        self.position = 0  # Position in the key of the next letter
+
+    def feed(self, chunk):
+        if not self.tables:
+            return chunk
+        parts = LETTER_RUNS.split(chunk)  # Alternating non-letters and letters, starting with non-letters
+        letters = list(''.join(parts[1::2]))
+        # Letters encoded with the same key letter are translated at once
+        size = len(self.tables)
+        for i in range(size):
+            table = self.tables[(self.position + i) % size]
+            letters[i::size] = ''.join(letters[i::size]).translate(table)
+        self.position = (self.position + len(letters)) % size
+        letters = ''.join(letters)
+        start = 0
+        for i in range(1, len(parts), 2):
+            end = start + len(parts[i])
+            parts[i] = letters[start:end]
+            start = end
+        return ''.join(parts)
+
+
+class TokenCodec(Codec):
+    """Codec working on whitespace-separated tokens, buffering a token split between chunks."""
+
+    def __init__(self):
+        """Initialization."""
+        self.buffer = ''
+
+    def token(self, token):
+        """Process a single token, return its output."""
+        raise NotImplementedError
+
+    def feed(self, chunk):
+        if not chunk:
+            return ''
+        tokens = (self.buffer + chunk).split()
+        self.buffer = ''
+        if tokens and not chunk[-1].isspace():
+            self.buffer = tokens.pop()
+        return ''.join([self.token(token) for token in tokens])
+
+    def finish(self):
+        output = self.token(self.buffer) if self.buffer else ''
+        self.buffer = ''
+        return output
+
+
 def encode_rot(message, offset, reverse=False):
     """Encode text using Caesar's ROT cipher."""
-    result = ''
-    for char in message:
-        if 'A' <= char <= 'Z' or 'a' <= char <= 'z':
-            result += shift(char, -offset if reverse else offset)
-        else:
-            result += char
-    return result
+    return RotCodec(offset, reverse).process(message)
 
 
 def encode_7879(message, reverse=False):
@@ -105,16 +662,44 @@ def encode_7879(message, reverse=False):
 
 def encode_vigenere(message, key, reverse=False):
     """Encode a text with Vigenere cipher."""
-    key = key.upper()
-    result = ''
-    i = 0
-    for char in message:
-        if 'A' <= char <= 'Z' or 'a' <= char <= 'z':
-            result += shift(char, (-1 if reverse else 1) * (ord(key[i]) - ord('A')))
-            i = (i + 1) % len(key)
-        else:
-            result += char
-    return result
+    return VigenereCodec(key, reverse).process(message)
+
+
+def crack_vigenere(message):
+    """Find the most likely key of a Vigenere-encoded message, using NumPy.
+
+    The key length is estimated using the index of coincidence of each column,
+    then each column's shift is the one minimizing the chi-squared statistic
+    against a language's letter frequencies. Return None if there are too few letters."""
+    codes = numpy.frombuffer(message.upper().encode('ascii', 'ignore'), dtype=numpy.uint8).astype(numpy.intp)
+    codes = codes[(codes >= ord('A')) & (codes <= ord('Z'))] - ord('A')
+    if len(codes) < 2:
+        return None
+    positions = numpy.arange(len(codes))
+
+    # Columns of an English text have an index of coincidence around 0.066, against 0.038 for random letters
+    # Multiples of the key length score as well, so the shortest length close to the best one is kept
+    coincidences = []
+    for length in range(1, min(MAX_KEY_LENGTH, len(codes) // 2) + 1):
+        counts = numpy.bincount(positions % length * 26 + codes, minlength=length * 26).reshape(length, 26)
+        totals = counts.sum(axis=1)
+        coincidences.append(((counts * (counts - 1)).sum(axis=1) / numpy.maximum(totals * (totals - 1), 1)).mean())
+    coincidences = numpy.array(coincidences)
+    length = int(numpy.argmax(coincidences >= coincidences.max() * 0.9)) + 1
+
+    # counts[column, shift, letter] is the number of times `letter` appears in a column decoded with `shift`
+    counts = numpy.bincount(positions % length * 26 + codes, minlength=length * 26).reshape(length, 26)
+    counts = counts[:, (numpy.arange(26)[:, None] + numpy.arange(26)) % 26]
+    totals = counts.sum(axis=2, keepdims=True)
+    best = None
+    for letters in list(UNIGRAMS.values()) or [numpy.array(ENGLISH) / sum(ENGLISH)]:
+        expected = numpy.maximum(totals * letters, 1e-6)
+        chi_squared = ((counts - expected) ** 2 / expected).sum(axis=2)
+        shifts = chi_squared.argmin(axis=1)
+        score = chi_squared.min(axis=1).sum()
+        if best is None or score < best[0]:
+            best = (score, shifts)
+    return ''.join([chr(ord('A') + shift) for shift in best[1]])
 
 
 MORSE = {'0': '-----', '1': '.----', '2': '..---', '3': '...--', '4': '....-',
@@ -123,27 +708,50 @@ MORSE = {'0': '-----', '1': '.----', '2': '..---', '3': '...--', '4': '....-',
          'H': '....', 'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..', 'M': '--', 'N': '-.',
          'O': '---', 'P': '.--.', 'Q': '--.-', 'R': '.-.', 'S': '...', 'T': '-', 'U': '..-',
          'V': '...-', 'W': '.--', 'X': '-..-', 'Y': '-.--', 'Z': '--..'}
+MORSE_ENCODE = dict(MORSE, **{' ': '/'})
+MORSE_DECODE = {code: char for char, code in MORSE_ENCODE.items()}
+
+
+class MorseEncoder(Codec):
+    """Encode text into Morse code, letters separated by spaces and words by slashes."""
+
+    def __init__(self):
+        """Initialization."""
+        self.started = False
+
+    def feed(self, chunk):
+        codes = [MORSE_ENCODE[char] for char in chunk.upper() if char in MORSE_ENCODE]
+        if not codes:
+            return ''
+        output = (' ' if self.started else '') + ' '.join(codes)
+        self.started = True
+        return output
+
+
+class MorseDecoder(TokenCodec):
+    """Decode Morse code, dots and dashes can also be written 0 and 1."""
+
+    def __init__(self):
+        """Initialization."""
+        super().__init__()
+        self.started = False
+        self.spaces = ''  # Spaces are only output when followed by a letter
+
+    def token(self, token):
+        char = MORSE_DECODE.get(token.replace('0', '.').replace('1', '-'), '')
+        if char == ' ':
+            if self.started:
+                self.spaces += char
+            return ''
+        if char:
+            char, self.spaces = self.spaces + char, ''
+            self.started = True
+        return char
 
 
 def encode_morse(text, reverse=False):
     """Encode text into Morse code."""
-    result = ''
-    if not reverse:
-        for char in text.upper():
-            if char in MORSE:
-                result += MORSE[char] + ' '
-            elif char == ' ':
-                result += '/ '
-    else:
-        text = text.replace('0', '.').replace('1', '-')
-        for word in text.split():
-            for char, mrs in MORSE.items():
-                if word == mrs:
-                    result += char
-                    break
-            if word == '/':
-                result += ' '
-    return result.strip()
+    return (MorseDecoder() if reverse else MorseEncoder()).process(text)
 
 
 def encode_cipher_box(text, size=0, reverse=False):
@@ -179,22 +787,104 @@ def encode_mixed_alphabet(key, text, reverse=False):
     return encode_substitute(key, text, reverse)
 
 
-def encode_substitute(alphabet, text, reverse=False):
-    """Encode using alphabet substitution."""
-    result = ''
+@functools.lru_cache(maxsize=64)
+def substitute_table(alphabet, reverse=False):
+    """Build the translation table of a substitution alphabet."""
     source = string.ascii_uppercase
     alphabet = alphabet.upper()
     if reverse:
         source, alphabet = alphabet, source
-    for char in text:
-        lower = 'a' <= char <= 'z'
-        char = char.upper()
-        if 'A' <= char <= 'Z':
-            char = alphabet[source.find(char)]
-        if lower:
-            char = char.lower()
-        result += char
-    return result
+    # Each letter is replaced according to its first occurrence in the source alphabet,
+    # letters without a counterpart (short or repeated-letter alphabets) are left unchanged
+    letters = [char for char in string.ascii_uppercase if source.find(char) < len(alphabet)]
+    return substitution_table(''.join(letters), ''.join([alphabet[source.find(char)] for char in letters]))
+
+
+def encode_substitute(alphabet, text, reverse=False):
+    """Encode using alphabet substitution."""
+    return SubstitutionCodec(alphabet, reverse).process(text)
+
+
+def crack_substitution(message, table, budget):
+    """Search the substitution alphabet maximizing the fitness of a decoded message.
+
+    Hill-climb from random alphabets, swapping two letters at a time, until `budget`
+    seconds have passed. Distinct ngrams are scored once, weighted by their number of
+    occurrences, and only the ngrams containing the swapped letters are rescored.
+    Return a (fitness, alphabet) tuple, fitness being the sum of the ngrams' log10 probabilities."""
+    deadline = time.monotonic() + budget
+    length = table.length
+    codes = letter_codes(message)
+    counts = collections.Counter([codes[start:start + length] for start in range(len(codes) - length + 1)])
+    ngrams = list(counts)
+    weights = [counts[ngram] for ngram in ngrams]
+    # containing[letter] lists the distinct ngrams in which a ciphertext letter appears
+    containing = [set() for _ in range(26)]
+    for position, ngram in enumerate(ngrams):
+        for code in ngram:
+            containing[code].add(position)
+    present = [letter for letter in range(26) if containing[letter]]
+    # Swappable letter pairs and the ngrams they change, letters absent from the message are interchangeable
+    pairs = [(a, b, sorted(containing[a] | containing[b])) for a in present for b in range(26)
+             if b != a and (not containing[b] or b > a)]
+
+    if numpy is not None:  # Ngrams are rescored all at once, as arrays of letter codes
+        place = 26 ** numpy.arange(length - 1, -1, -1)
+        probabilities = table.array
+        grams = numpy.array([list(ngram) for ngram in ngrams], dtype=numpy.intp).reshape(-1, length)
+        weights = numpy.array(weights, dtype=numpy.float64)
+        pairs = [(a, b, numpy.array(changed, dtype=numpy.intp), grams[changed], weights[changed])
+                 for a, b, changed in pairs]
+
+        def climb(key):
+            key = numpy.array(key, dtype=numpy.intp)
+            scores = probabilities[key[grams] @ place]
+            improved = True
+            while improved and time.monotonic() < deadline:
+                improved = False
+                for a, b, changed, changed_grams, changed_weights in pairs:
+                    key[a], key[b] = key[b], key[a]
+                    new = probabilities[key[changed_grams] @ place]
+                    if (new - scores[changed]) @ changed_weights > 0:
+                        scores[changed] = new
+                        improved = True
+                    else:
+                        key[a], key[b] = key[b], key[a]
+            return float(scores @ weights), key.tolist()
+    else:
+        probabilities = table.probabilities
+
+        def score(key, ngram):
+            index = 0
+            for code in ngram:
+                index = index * 26 + key[code]
+            return probabilities[index]
+
+        def climb(key):
+            scores = [score(key, ngram) for ngram in ngrams]
+            improved = True
+            while improved and time.monotonic() < deadline:
+                improved = False
+                for a, b, changed in pairs:
+                    key[a], key[b] = key[b], key[a]
+                    new = [score(key, ngrams[position]) for position in changed]
+                    if sum([(value - scores[position]) * weights[position]
+                            for position, value in zip(changed, new)]) > 0:
+                        for position, value in zip(changed, new):
+                            scores[position] = value
+                        improved = True
+                    else:
+                        key[a], key[b] = key[b], key[a]
+            return sum([value * weight for value, weight in zip(scores, weights)]), key
+
+    best = None
+    while best is None or time.monotonic() < deadline:
+        key = list(range(26))  # Ciphertext letter to plaintext letter
+        random.shuffle(key)
+        fitness, key = climb(key)
+        if best is None or fitness > best[0]:
+            best = (fitness, ''.join([chr(ord('A') + letter) for letter in key]))
+    return best
 
 
 class Polybius:
@@ -206,22 +896,22 @@ class Polybius:
         self.mat = [[None] * size for _ in range(size)]
         self.replace = replace or ''
         self.replace_by = replace_by or ''
+        self.index = {}  # letter:(x, y) mapping
 
     def fill(self, alphabet='ABCDEFGHIKLMNOPQRSTUVWXYZ'):
         """Initialize the cipher."""
-        for x in range(self.size):
-            for y in range(self.size):
+        self.index = {}
+        for x in reversed(range(self.size)):  # The first occurrence of a letter is kept
+            for y in reversed(range(self.size)):
                 self.mat[x][y] = alphabet[x * self.size + y]
+                self.index[self.mat[x][y]] = (x + 1), (y + 1)
 
     def encode(self, letter):
         """Encode a letter."""
         letter = letter.upper()
         if letter == self.replace:
             letter = self.replace_by
-        for x in range(self.size):
-            for y in range(self.size):
-                if self.mat[x][y] == letter:
-                    return (x + 1), (y + 1)
+        return self.index.get(letter)
 
     def decode(self, x, y):
         """Decode a letter."""
@@ -230,44 +920,58 @@ class Polybius:
         return ''
 
 
+TAP_SQUARE = Polybius(5, 'K', 'C')
+TAP_SQUARE.fill()
+
+
+class TapEncoder(Codec):
+    """Encode text using the tap code, spaces are replaced by X."""
+
+    def feed(self, chunk):
+        codes = [TAP_SQUARE.encode(char) for char in chunk.replace(' ', 'X').upper()]
+        return ''.join(['%s %s ' % ('.' * code[0], '.' * code[1]) for code in codes if code is not None])
+
+
+class TapDecoder(TokenCodec):
+    """Decode the tap code, each letter being two groups of taps.
+
+    `finish` raises ValueError if the number of groups is odd."""
+
+    def __init__(self):
+        """Initialization."""
+        super().__init__()
+        self.row = None  # First group of taps of the current letter
+
+    def token(self, token):
+        if self.row is None:
+            self.row = len(token)
+            return ''
+        char = TAP_SQUARE.decode(self.row, len(token))
+        self.row = None
+        return char
+
+    def finish(self):
+        output = super().finish()
+        if self.row is not None:
+            raise ValueError('Odd number of tap groups')
+        return output
+
+
 def encode_tap_code(text, reverse=False):
     """Encode text using the tap code."""
-    square = Polybius(5, 'K', 'C')
-    square.fill()
-    if not reverse:
-        result = ''
-        for char in text.replace(' ', 'X').upper():
-            code = square.encode(char)
-            if code is not None:
-                result += '%s %s ' % ('.' * code[0], '.' * code[1])
-        return result
-    else:
-        words = text.split()
-        if len(words) % 2:
-            return
-        result = ''
-        for i in range(0, len(words), 2):
-            char = square.decode(len(words[i]), len(words[i+1]))
-            if char is not None:
-                result += char
-        return result
+    try:
+        return (TapDecoder() if reverse else TapEncoder()).process(text)
+    except ValueError:
+        return None
 
 
 @cog.command(fulltext=True)
 def atbash(text):
     """Encode text using the Atbash cipher."""
-    result = ''
-    for char in text:
-        if 'A' <= char <= 'Z':
-            result += chr(ord('A') + ord('Z') - ord(char))
-        elif 'a' <= char <= 'z':
-            result += chr(ord('a') + ord('z') - ord(char))
-        else:
-            result += char
-    return result
+    return AtbashCodec().process(text)
 
 
-@cog.command(fulltext=True, flags={'d': 'decode', 'e': 'encode'})
+@cog.command(fulltext=True, flags={'d': 'decode', 'e': 'encode'}, executor='thread')
 @cog.alias('rot')
 def caesar(offset: int, text, flags):
     """Encode text using Caesar's ROT cipher.
@@ -278,7 +982,12 @@ def caesar(offset: int, text, flags):
     if offset:
         return encode_rot(text, offset, reverse='d' in flags)
     else:
-        scores = [(analyze_frequency(encode_rot(text, off)), off) for off in range(26)]
+        if analyze_fitness(text):
+            scores = [(analyze_fitness(encode_rot(text, off)), off) for off in range(26)]
+        elif numpy is not None and text.isascii():
+            scores = list(zip(analyze_rotations(text), range(26)))
+        else:
+            scores = [(analyze_frequency(encode_rot(text, off)), off) for off in range(26)]
         scores.sort()
         output = ''
         for freq, offset in scores[:3]:
@@ -294,12 +1003,23 @@ def rot7879(text, flags):
     return encode_7879(text, reverse='d' in flags)
 
 
-@cog.command(fulltext=True, flags={'d': 'decode', 'e': 'encode'})
+@cog.command(fulltext=True, flags={'d': 'decode', 'e': 'encode', 'c': 'crack, find the key and decode'},
+             executor='thread')
 @cog.alias('vig')
 def vigenere(key: 'Vigenere encryption key', text, flags):
-    """Encode a text with Vigenere cipher."""
-    if 'd' in flags and 'e' in flags:
-        return _('Mutually exclusive flags: -d and -e')
+    """Encode a text with Vigenere cipher.
+
+    When cracking, no key must be given: the first word is part of the text."""
+    if len(set(flags) & set('dec')) > 1:
+        return _('Mutually exclusive flags: -d, -e and -c')
+    if 'c' in flags:
+        if numpy is None:
+            return _('Cracking requires NumPy')
+        text = '%s %s' % (key, text)
+        key = crack_vigenere(text)
+        if key is None:
+            return _('Not enough letters to find a key')
+        return f"`{key}` {encode_vigenere(text, key, reverse=True)}"
     return encode_vigenere(text, key, reverse='d' in flags)
 
 
@@ -365,6 +1085,22 @@ def subs(alphabet: 'Substitute alphabet (all 26 letters)', text, flags):
     return encode_substitute(alphabet, text)
 
 
+@cog.command(fulltext=True, executor='process')
+def subs_crack(text):
+    """Find the alphabet of a substitution cipher and decode text.
+
+    Works best with a few hundred letters."""
+    tables = [(lang, tables[4]) for lang, tables in DENSE.items() if 4 in tables]
+    if not tables:
+        return _('No quadgram data available')
+    if len(letter_codes(text)) < 20:
+        return _('Not enough letters to find a key')
+    # Languages share the time budget, the best alphabet of all is kept
+    fitness, alphabet, lang = max([crack_substitution(text, table, SUBS_TIME / len(tables)) + (lang,)
+                                   for lang, table in tables])
+    return f"`{alphabet}` {encode_substitute(alphabet, text)} `[{lang}]`"
+
+
 @cog.command(fulltext=True, flags={'d': 'decode', 'e': 'encode'})
 def taptap(text, flags):
     """Encode text using the tap code."""
@@ -373,10 +1109,10 @@ def taptap(text, flags):
     return encode_tap_code(text, reverse='d' in flags)
 
 
-@cog.command(fulltext=True)
+@cog.command(fulltext=True, executor='process')
 def language(text):
     """Determine language of text (not all are supported)."""
-    distances = analyze_frequency(text)
+    distances = analyze_fitness(text) or analyze_frequency(text)
     upper = distances[0][0] + (distances[-1][0] - distances[0][0]) / 10
     langs = [lang for dist, lang in distances if dist <= upper]
     if len(langs) == 1:
@@ -385,8 +1121,234 @@ def language(text):
         return _("This message seems to be in {language}, or maybe in {language2}").format(language=langs[0],
                                                                                            language2=langs[1])
     else:
-        return _("Multiple languages have been detected: {languages}").format(gearbox.pretty(langs, final=_('and')))
+        return _("Multiple languages have been detected: {languages}").format(
+            languages=gearbox.pretty(langs, final=_('and')))
+
+
+def chunks(data, size=CHUNK_SIZE):
+    """Split bytes or a string into chunks of at most `size` items."""
+    view = memoryview(data) if isinstance(data, (bytes, bytearray)) else data
+    for start in range(0, len(data), size):
+        yield view[start:start + size]
+
+
+def digest(algorithm, data):
+    """Hash chunks of bytes, return the hexadecimal digest."""
+    hasher = hashlib.new(algorithm)
+    for chunk in data:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def decode_base(base, text):
+    """Decode text written in a base (given as a string), return bytes.
+
+    Base 256 is UTF-8 text, base 10 is space-separated byte values, others ignore whitespace.
+    Raise ValueError (or binascii.Error, its subclass) on invalid input."""
+    if base == '256':
+        return text.encode()
+    if base == '10':
+        if not BASE_PATTERNS[base].fullmatch(text):
+            raise ValueError('Invalid digit')
+        return bytes([int(number) for number in text.split()])
+    digits = ''.join(text.split())
+    if not BASE_PATTERNS[base].fullmatch(digits):
+        raise ValueError('Invalid digit')
+    if base == '2':
+        if len(digits) % 8:
+            raise ValueError('Incomplete byte')
+        # Chunk sizes are multiples of 8 bits, so that they convert to whole bytes
+        return b''.join([int(chunk, 2).to_bytes(len(chunk) // 8, 'big') for chunk in chunks(digits, CHUNK_SIZE * 8)])
+    if base == '16':
+        return b''.join([binascii.unhexlify(chunk) for chunk in chunks(digits, CHUNK_SIZE * 2)])
+    return b''.join([binascii.a2b_base64(chunk) for chunk in chunks(digits, CHUNK_SIZE * 4)])
+
+
+def encode_base(base, data):
+    """Write bytes in a base (given as a string), see `decode_base`."""
+    if base == '256':
+        return data.decode(errors='replace')
+    if base == '2':
+        return ' '.join(map(BINARY.__getitem__, data))
+    if base == '10':
+        return ' '.join(map(str, data))
+    if base == '16':
+        return ''.join([binascii.hexlify(chunk).decode() for chunk in chunks(data)])
+    # Chunk sizes are multiples of 3 bytes, so that no padding appears between chunks
+    return ''.join([binascii.b2a_base64(chunk, newline=False).decode() for chunk in chunks(data, CHUNK_SIZE * 3)])
+
+
+def convert_base(source, target, text):
+    """Convert text from a base to another, return None if it is invalid."""
+    try:
+        return encode_base(target, decode_base(source, text))
+    except (ValueError, OverflowError):
+        return None
+
 
+async def offload(size, func, *args):
+    """Call a function, in the thread pool if its input is larger than `OFFLOAD_SIZE`."""
+    if size > OFFLOAD_SIZE:
+        return await gearbox.run_in_executor('thread', func, *args)
+    return func(*args)
 
-# TODO hash functions (md5, sha1/224/256/384/512)
-# TODO base conversion (2, 10, 16, 64, 256)
+
+async def digest_attachment(algorithm, attachment):
+    """Hash an attachment as it is downloaded, return the hexadecimal digest."""
+    hasher = hashlib.new(algorithm)
+    async for chunk in attachment.chunks():
+        if len(chunk) > OFFLOAD_SIZE:
+            await gearbox.run_in_executor('thread', hasher.update, chunk)
+        else:
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+@cog.command(fulltext=True)
+@cog.rename('hash')
+async def hash_text(channel, attachments, algorithm: HASHES, text=''):
+    """Hash text (encoded in UTF-8), or the attached files."""
+    if not attachments:
+        data = text.encode()
+        await channel.send('`%s`' % await offload(len(data), digest, algorithm, chunks(data)))
+        return
+    lines = []
+    for attachment in attachments:
+        try:
+            lines.append('`%s` %s' % (await digest_attachment(algorithm, attachment), attachment.filename))
+        except gearbox.AttachmentTooLarge:
+            lines.append(_('{name} is too large').format(name=attachment.filename))
+        except gearbox.AttachmentError:
+            lines.append(_('{name} could not be downloaded').format(name=attachment.filename))
+    await channel.send('\n'.join(lines))
+
+
+@cog.command(fulltext=True)
+async def base(channel, source: BASES, target: BASES, text):
+    """Convert text between bases 2, 10 (bytes), 16, 64 and 256 (text).
+
+    Long results are sent as a file."""
+    output = await offload(len(text), convert_base, source, target, text)
+    if not output:
+        await channel.send(_('Invalid base {base} input').format(base=source))
+    elif len(output) > MAX_OUTPUT:
+        await channel.send(file=discord.File(io.BytesIO(output.encode()), 'base%s.txt' % target))
+    else:
+        await channel.send(output)
+
+
+class Frequencies:
+    """Letter, bigram and trigram counts of a text given in chunks of bytes.
+
+    Only ASCII letters are counted, case-insensitively; anything else breaks ngrams.
+    Counts are arrays indexed like `DenseTable` when NumPy is installed, Counters otherwise."""
+
+    LENGTHS = (1, 2, 3)
+
+    def __init__(self):
+        """Initialization."""
+        if numpy is not None:
+            self.counts = {length: numpy.zeros(26 ** length, dtype=numpy.int64) for length in self.LENGTHS}
+        else:
+            self.counts = {length: collections.Counter() for length in self.LENGTHS}
+        self.tail = b''  # Last bytes of the previous chunk, to count ngrams spanning two chunks
+
+    def feed(self, chunk):
+        """Count the ngrams of a chunk of bytes."""
+        data = self.tail + bytes(chunk).upper()
+        skip = len(self.tail)  # Ngrams ending in the tail were already counted
+        self.tail = data[-(max(self.LENGTHS) - 1):]
+        if numpy is not None:
+            codes = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.intp) - ord('A')
+            letters = (codes >= 0) & (codes < 26)
+            for length in self.LENGTHS:
+                start = max(0, skip - length + 1)
+                count = len(codes) - length + 1 - start
+                if count < 1:
+                    continue
+                valid = letters[start:start + count].copy()
+                indexes = codes[start:start + count].copy()
+                for i in range(1, length):
+                    valid &= letters[start + i:start + i + count]
+                    indexes *= 26
+                    indexes += codes[start + i:start + i + count]
+                self.counts[length] += numpy.bincount(indexes[valid], minlength=26 ** length)
+        else:
+            text = data.decode('latin-1')
+            for length in self.LENGTHS:
+                start = max(0, skip - length + 1)
+                self.counts[length].update([text[i:i + length] for i in range(start, len(text) - length + 1)
+                                            if text[i:i + length].isalpha() and text[i:i + length].isascii()])
+
+    def top(self, length, count):
+        """Return the `count` most frequent ngrams of a given length, as (ngram, count) tuples."""
+        if numpy is None:
+            return sorted(self.counts[length].items(), key=lambda item: (-item[1], item[0]))[:count]
+        counts = self.counts[length]
+        order = numpy.lexsort((numpy.arange(len(counts)), -counts))[:count]
+        result = []
+        for index in order.tolist():
+            if counts[index]:
+                ngram = ''
+                for position in range(length):
+                    ngram = chr(ord('A') + index // 26 ** position % 26) + ngram
+                result.append((ngram, int(counts[index])))
+        return result
+
+    def total(self, length):
+        """Return the number of ngrams of a given length."""
+        return int(self.counts[length].sum()) if numpy is not None else sum(self.counts[length].values())
+
+    def letter_counts(self):
+        """Return the count of each letter, from A to Z."""
+        if numpy is not None:
+            return self.counts[1].tolist()
+        return [self.counts[1][letter] for letter in string.ascii_uppercase]
+
+
+def describe_frequencies(frequencies):
+    """Format letter statistics and the most frequent ngrams."""
+    letters = frequencies.letter_counts()
+    total = sum(letters)
+    if not total:
+        return _('No letters found')
+    coincidence = sum([count * (count - 1) for count in letters]) / max(total * (total - 1), 1)
+    entropy = -sum([count / total * math.log2(count / total) for count in letters if count])
+    columns = [frequencies.top(length, TOP_FREQUENCIES) for length in Frequencies.LENGTHS]
+    totals = [frequencies.total(length) for length in Frequencies.LENGTHS]
+    lines = []
+    for row in range(max([len(column) for column in columns])):
+        cells = []
+        for column, column_total in zip(columns, totals):
+            if row < len(column):
+                ngram, count = column[row]
+                cells.append('%-3s %5.2f%%' % (ngram, 100 * count / column_total))
+            else:
+                cells.append(' ' * 10)
+        lines.append('   '.join(cells).rstrip())
+    return _('{letters} letters, index of coincidence {coincidence:.4f}, entropy {entropy:.3f} bits').format(
+        letters=total, coincidence=coincidence, entropy=entropy) + '\n```\n' + '\n'.join(lines) + '\n```'
+
+
+@cog.command(fulltext=True)
+async def freq(channel, attachments, text=''):
+    """Analyze the frequencies of letters, bigrams and trigrams in text and attached files."""
+    frequencies = Frequencies()
+    sources = [chunks(text.encode())]
+    sources += [attachment.chunks() for attachment in attachments or []]
+    try:
+        for source in sources:
+            if isinstance(source, collections.abc.AsyncIterator):
+                async for chunk in source:
+                    await offload(len(chunk), frequencies.feed, chunk)
+            else:
+                for chunk in source:
+                    await offload(len(chunk), frequencies.feed, chunk)
+            frequencies.feed(b' ')  # Ngrams do not span sources
+    except gearbox.AttachmentTooLarge as exc:
+        await channel.send(_('{name} is too large').format(name=exc))
+        return
+    except gearbox.AttachmentError as exc:
+        await channel.send(_('{name} could not be downloaded').format(name=exc))
+        return
+    await channel.send(describe_frequencies(frequencies))
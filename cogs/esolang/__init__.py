@@ -1,13 +1,109 @@
 """Esoteric languages interpreters."""
+import array
+import asyncio
+import collections
 import time
+import unittest
+import unittest.mock
 import gearbox
+from ._sandbox import Sandbox
 
 cog = gearbox.Cog()
 _ = cog.gettext
 
-MAX_TICK = 200000
+MAX_TICK = 1000000
 MAX_TIME = 0.5
 MAX_SIZE = 1800
+MAX_MEMORY = 64 << 20  # Memory a program may allocate, in bytes
+SLICE = 10000  # Number of ticks executed between two time checks (and two yields to the event loop)
+WORKERS = 2  # Number of sandbox worker processes, 0 to run programs cooperatively inside the bot process
+SANDBOX = None
+COMPILE_CACHE = (256, 1 << 20)  # Maximum number of compiled programs kept, and their total source size
+RESULT_CACHE = (1024, 4 << 20)  # Maximum number of results kept, and their total size (code, input and output)
+
+
+class TestEsolang(unittest.TestCase):
+    PROGRAMS = [
+        ('bf', '++++++++[>++++[>++>+++>+++>+<<<<-]>+>+>->>+[<]<-]>>.>---.+++++++..+++.>>.<-.<.+++.------.--------.'
+               '>>+.>++.', ''),  # Hello World!
+        ('bf', '++++++++[>++++++++<-]>+.', ''),  # Multiply loop
+        ('bf', '+++[+>+<]>.', ''),  # Multiply loop with a positive step, wrapping around
+        ('bf', '+++++[->++>>-<<<]>.>>.', ''),  # Multiply loop with a negative factor
+        ('bf', '<' + '+' * 65 + '.>.-.', ''),  # Tape and cells wrapping around
+        ('bf', ',[.,]', 'hello'),  # Input
+        ('bf', ',+.,.', ''),  # Reading past the input
+        ('bf', '++[>+++[>+.<-]<-]', ''),  # Nested loops with output
+        ('bf', '+>+>+>+[<]>.', ''),  # Loop moving the head
+        ('bf', 'Comments + are + ignored [-]++.', ''),
+        ('stbf', '+++++)++(.@.)>@=.$(.', ''),
+        ('stbf', '++++)>++++++++{.+)++&.^.|.}._.', ''),
+    ]
+
+    @staticmethod
+    def reference(code, word, extra=''):
+        """Run a program one source instruction at a time, return its (output, state, ticks)."""
+        code = ''.join([char for char in code if char in '+-<>.,[]' + extra])
+        memory = [0] * Brainfuck.MEM_SIZE
+        head = ptr = ticks = 0
+        output = ''
+        stack = []
+        word = list(word)
+        while ptr < len(code):
+            char = code[ptr]
+            if char in '[]' and (not memory[head]) == (char == '['):
+                step, nested = (1, 1) if char == '[' else (-1, 1)
+                while nested:
+                    ptr += step
+                    if not 0 <= ptr < len(code):
+                        return output, Interpreter.ERROR, ticks
+                    nested += {'[': step, ']': -step}.get(code[ptr], 0)
+            elif char in '+-':
+                memory[head] = (memory[head] + (1 if char == '+' else -1)) % 256
+            elif char in '<>':
+                head = (head + (1 if char == '>' else -1)) % Brainfuck.MEM_SIZE
+            elif char == '.':
+                output += chr(memory[head])
+            elif char == ',':
+                memory[head] = ord(word.pop(0)) if word else 0
+            elif char == ')':
+                stack.append(memory[head])
+            elif char == '(':
+                memory[head] = stack.pop() if stack else 0
+            elif char == '@':
+                memory[head] = stack[-1] if stack else 0
+            elif char == '$' and stack:
+                stack.pop()
+            elif char in extra and stack:
+                operations = {'=': int.__add__, '_': int.__sub__, '}': int.__rshift__, '{': int.__lshift__,
+                              '|': int.__or__, '^': int.__xor__, '&': int.__and__}
+                memory[head] = operations[char](memory[head], stack[-1]) % 256
+            ticks += 1
+            ptr += 1
+        return output, Interpreter.DONE, ticks
+
+    def test_programs(self):
+        for language, code, word in self.PROGRAMS:
+            output, state, message, ticks, seconds = execute(language, code, word)
+            self.assertEqual((output, state, ticks), self.reference(code, word, LANGS[language].EXTRA), code)
+
+    def test_unbalanced(self):
+        for code, bracket in (('[', '['), ('+[', '['), ('[[]', '['), (']', ']'), ('+]', ']'), ('[]]', ']')):
+            output, state, message, ticks, seconds = execute('bf', code, '')
+            self.assertEqual((state, message, ticks), (Interpreter.ERROR, bracket, 0), code)
+        # Brackets are checked before running, so there is no partial output before reaching them
+        self.assertEqual(self.reference('[', ''), ('', Interpreter.ERROR, 0))
+        self.assertEqual(execute('bf', '+.+]', '')[:3], ('', Interpreter.ERROR, ']'))
+
+    def test_limits(self):
+        with unittest.mock.patch(__name__ + '.MAX_TIME', float('inf')):
+            output, state, message, ticks, seconds = execute('bf', '+[]', '')
+            # Limits are checked between slices, every operation of this loop stands for a single tick
+            self.assertEqual((state, ticks), (Interpreter.ABORT, MAX_TICK))
+            output, state, message, ticks, seconds = execute('bf', '+[>+<+]', '')
+            self.assertEqual(state, Interpreter.DONE)
+            self.assertEqual(ticks, self.reference('+[>+<+]', '')[2])
+        output, state, message, ticks, seconds = execute('bf', '+[.]', '')
+        self.assertEqual((state, len(output)), (Interpreter.ABORT, MAX_SIZE + 1))
 
 
 class Word:
@@ -15,13 +111,74 @@ class Word:
 
     def __init__(self, word):
         self.word = word
+        self.index = 0
 
     def read(self):
-        val = 0
-        if len(self.word) > 0:
-            val = ord(self.word[0])
-            self.word = self.word[1:]
-        return val
+        if self.index >= len(self.word):
+            return 0
+        self.index += 1
+        return ord(self.word[self.index - 1])
+
+
+class Output:
+    """Output buffer, which stops accepting characters once it holds more than `size` of them."""
+
+    def __init__(self, size):
+        self.size = size
+        self.chars = []
+        self.full = False
+
+    def write(self, char):
+        """Append a character to the output, if not full."""
+        if not self.full:
+            self.chars.append(char)
+            self.full = len(self.chars) > self.size
+
+    def getvalue(self):
+        """Return the output as a string."""
+        return ''.join(self.chars)
+
+
+class Cache:
+    """Least recently used cache, bounded in number of entries and in total size."""
+
+    def __init__(self, entries, size):
+        self.data = collections.OrderedDict()  # key:(value, size) mapping, least recently used first
+        self.entries = entries
+        self.max_size = size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the value cached for a key, or None."""
+        try:
+            value = self.data[key][0]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size):
+        """Cache a value, `size` being an estimation of the memory it uses."""
+        if size > self.max_size:
+            return
+        if key in self.data:
+            self.size -= self.data.pop(key)[1]
+        self.data[key] = (value, size)
+        self.size += size
+        while len(self.data) > self.entries or self.size > self.max_size:
+            self.size -= self.data.popitem(last=False)[1][1]
+
+
+def tape(size, bits):
+    """Return a zero-filled array of `size` cells able to hold `bits` bits each."""
+    for typecode in 'BHILQ':
+        if array.array(typecode).itemsize * 8 >= bits:
+            return array.array(typecode, bytes(array.array(typecode).itemsize * size))
+    raise ValueError('Cells cannot be larger than 64 bits')
 
 
 class Interpreter:
@@ -35,197 +192,337 @@ class Interpreter:
         self.code = code
         self.word = word
         self.state = Interpreter.INIT
-        self.output = ''
-        self.message = ''
+        self.output = Output(MAX_SIZE)
+        self.message = ''  # Error, kept untranslated as results are shared between guilds
+        self.ticks = 0
+        self.seconds = 0.
 
-    def run(self):
+    def start(self):
+        """Prepare the program for execution."""
         self.state = Interpreter.RUN
-        ticks = 0
-        start = time.time()
-        while self.state == Interpreter.RUN:
-            if self.step():
-                ticks += 1
-            if ticks >= MAX_TICK:
-                self.state = Interpreter.ABORT
-            if time.time() - start >= MAX_TIME:
-                self.state = Interpreter.ABORT
-        return self.output, self.state, self.message, ticks, time.time() - start
+
+    def resume(self, ticks=SLICE):
+        """Run the program for about `ticks` ticks, return whether or not it is still running.
+
+        The tick and time budgets are only checked between slices."""
+        start = time.perf_counter()
+        limit = min(self.ticks + ticks, MAX_TICK)
+        while self.state == Interpreter.RUN and self.ticks < limit:
+            self.ticks += self.step()
+        self.seconds += time.perf_counter() - start
+        if self.state == Interpreter.RUN and (self.ticks >= MAX_TICK or self.seconds >= MAX_TIME):
+            self.state = Interpreter.ABORT
+        return self.state == Interpreter.RUN
+
+    def result(self):
+        """Return the (output, state, message, ticks, seconds) result of the program."""
+        return self.output.getvalue(), self.state, self.message, self.ticks, self.seconds
+
+    def run(self):
+        """Run the whole program at once."""
+        self.start()
+        while self.resume():
+            pass
+        return self.result()
+
+    async def run_async(self):
+        """Run the whole program, yielding to the event loop between slices."""
+        self.start()
+        while self.resume():
+            await asyncio.sleep(0)
+        return self.result()
 
     def step(self):
+        """Execute one step of the program and return the number of instructions it represents."""
         self.state = Interpreter.DONE
-        return True
+        return 1
+
+
+# Operations of the compiled Brainfuck representation, as (operation, argument, ticks) tuples
+# where ticks is the number of source instructions the operation stands for
+ADD = 0  # Add argument to the current cell
+MOVE = 1  # Move head by argument cells
+OUTPUT = 2  # Output the current cell
+INPUT = 3  # Read input into the current cell
+OPEN = 4  # `[`, argument is the index of the matching CLOSE
+CLOSE = 5  # `]`, argument is the index of the matching OPEN
+MULTIPLY = 6  # Loop without I/O nor nested loop, argument is (counter step, ((offset, factor), ...))
+EXTRA = 7  # Language-specific instruction, argument is the instruction character
+
+FOLDABLE = {'+': (ADD, 1), '-': (ADD, -1), '>': (MOVE, 1), '<': (MOVE, -1)}
+
+
+def compile_brainfuck(code, extra=''):
+    """Compile Brainfuck code, where `extra` contains language-specific instructions.
+
+    Return an (operations, error) tuple, error being None or the unmatched bracket.
+    Compiled programs are cached by their instructions, ignoring comments."""
+    instructions = set('+-<>.,[]' + extra)
+    source = ''.join([char for char in code if char in instructions])
+    key = (extra, source)
+    compiled = COMPILED.get(key)
+    if compiled is None:
+        compiled = compile_source(source)
+        COMPILED.put(key, compiled, len(source))
+    return compiled
+
+
+def compile_source(source):
+    """Compile Brainfuck code stripped of its non-instructions, see `compile_brainfuck`."""
+    ops = []
+    opened = []  # Indexes of unmatched OPEN operations
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if char in FOLDABLE:  # Fold runs of +- and <> into a single operation
+            op = FOLDABLE[char][0]
+            value = 0
+            start = i
+            while i < len(source) and source[i] in FOLDABLE and FOLDABLE[source[i]][0] == op:
+                value += FOLDABLE[source[i]][1]
+                i += 1
+            ops.append((op, value, i - start))
+            continue
+        if char == '[':
+            loop = multiply_loop(source, i)
+            if loop is not None:
+                body_length, arg = loop
+                ops.append((MULTIPLY, arg, body_length))
+                i += body_length + 2
+                continue
+            opened.append(len(ops))
+            ops.append((OPEN, None, 1))
+        elif char == ']':
+            if not opened:
+                return [], ']'
+            start = opened.pop()
+            ops[start] = (OPEN, len(ops), 1)
+            ops.append((CLOSE, start, 1))
+        elif char == '.':
+            ops.append((OUTPUT, None, 1))
+        elif char == ',':
+            ops.append((INPUT, None, 1))
+        else:
+            ops.append((EXTRA, char, 1))
+        i += 1
+    if opened:
+        return [], '['
+    return ops, None
+
+
+def multiply_loop(source, start):
+    """Recognize loops like `[-]` or `[->+>++<<]` starting at `source[start]`.
+
+    Those loops only contain `+-<>`, move back to where they started, and change
+    the current cell by exactly 1 each iteration. Return (body length, argument)
+    for the MULTIPLY operation, or None if the loop doesn't match."""
+    offset = 0
+    deltas = {}
+    i = start + 1
+    while i < len(source) and source[i] in FOLDABLE:
+        op, value = FOLDABLE[source[i]]
+        if op == MOVE:
+            offset += value
+        else:
+            deltas[offset] = deltas.get(offset, 0) + value
+        i += 1
+    if i >= len(source) or source[i] != ']' or offset != 0 or deltas.get(0) not in (-1, 1):
+        return None
+    step = deltas.pop(0)
+    return i - start - 1, (step, tuple((off, factor) for off, factor in deltas.items() if factor))
+
 
 class Brainfuck(Interpreter):
-    """Brainfuck interpreter."""
+    """Brainfuck interpreter, executing a compiled version of the code."""
     MEM_SIZE = 30000
-    CELL_SIZE = 1<<8 # In bits
+    CELL_BITS = 8
+    CELL_SIZE = 1 << CELL_BITS  # Cells hold values modulo CELL_SIZE
+    EXTRA = ''  # Instructions specific to derived languages
+
     def __init__(self, code, word):
         super().__init__(code, word)
-        self.memory = [0] * self.MEM_SIZE
+        self.memory = tape(self.MEM_SIZE, self.CELL_BITS)
         self.head = 0
         self.code_ptr = 0
+        self.ops, error = compile_brainfuck(code, self.EXTRA)
+        self.message = error or ''  # The unmatched bracket, translated by `eso`
+
+    def start(self):
+        if self.message:  # Compilation error
+            self.state = Interpreter.ERROR
+        elif not self.ops:
+            self.state = Interpreter.DONE
+        else:
+            self.state = Interpreter.RUN
 
     def step(self):
-        c = self.code[self.code_ptr]
-        if c == '+':
-            self.memory[self.head] += 1
-            self.memory[self.head] %= self.CELL_SIZE
-        elif c == '-':
-            self.memory[self.head] -= 1
-            self.memory[self.head] %= self.CELL_SIZE
-        elif c == '>':
-            self.head += 1
-            self.head %= self.MEM_SIZE
-        elif c == '<':
-            self.head -= 1
-            self.head %= self.MEM_SIZE
-        elif c == '.':
-            self.output += chr(self.memory[self.head])
-        elif c == ',':
-            self.memory[self.head] = self.word.read()
-        elif c == '[':
-            if not self.memory[self.head]:
-                nested = 1
-                while nested:
-                    self.code_ptr += 1
-                    if self.code_ptr >= len(self.code):
-                        self.message = _('No matching `]`')
-                        self.state = Interpreter.ERROR
-                        return
-                    if self.code[self.code_ptr] == '[':
-                        nested += 1
-                    if self.code[self.code_ptr] == ']':
-                        nested -= 1
-        elif c == ']':
-            if self.memory[self.head]:
-                nested = 1
-                while nested:
-                    self.code_ptr -= 1
-                    if self.code_ptr < 0:
-                        self.message = _('No matching `[`')
-                        self.state = Interpreter.ERROR
-                        return
-                    if self.code[self.code_ptr] == ']':
-                        nested += 1
-                    if self.code[self.code_ptr] == '[':
-                        nested -= 1
+        op, arg, ticks = self.ops[self.code_ptr]
+        memory = self.memory
+        if op == ADD:
+            memory[self.head] = (memory[self.head] + arg) % self.CELL_SIZE
+        elif op == MOVE:
+            self.head = (self.head + arg) % self.MEM_SIZE
+        elif op == OPEN:
+            if not memory[self.head]:
+                self.code_ptr = arg
+        elif op == CLOSE:
+            if memory[self.head]:
+                self.code_ptr = arg
+        elif op == MULTIPLY:
+            value = memory[self.head]
+            if value:
+                step, targets = arg
+                count = value if step < 0 else self.CELL_SIZE - value
+                for offset, factor in targets:
+                    cell = (self.head + offset) % self.MEM_SIZE
+                    memory[cell] = (memory[cell] + factor * count) % self.CELL_SIZE
+                memory[self.head] = 0
+                ticks = 1 + count * (ticks + 1)
+            else:
+                ticks = 1
+        elif op == OUTPUT:
+            self.output.write(chr(memory[self.head]))
+            if self.output.full:  # No need to go further
+                self.state = Interpreter.ABORT
+        elif op == INPUT:
+            memory[self.head] = self.word.read() % self.CELL_SIZE
         else:
-            return
+            self.extra(arg)
         self.code_ptr += 1
-        if self.code_ptr >= len(self.code):
+        if self.code_ptr >= len(self.ops):
             self.state = Interpreter.DONE
-        return True
-        
-class Stacked_Brainfuck(Interpreter):
+        return ticks
+
+    def extra(self, char):
+        """Execute a language-specific instruction."""
+        pass
+
+
+class Stacked_Brainfuck(Brainfuck):
     """Stacked brainfuck interpreter"""
-    MEM_SIZE = 30000
-    CELL_SIZE = 1<<8 # in bits
+    EXTRA = '$=_}{|^&)(@'
+
     def __init__(self, code, word):
         super().__init__(code, word)
-        self.memory = [0] * self.MEM_SIZE
-        self.head = 0
-        self.code_ptr = 0
         self.stack = []
-        
-    def step(self):
-        c = self.code[self.code_ptr]
-        if self.stack:
-            if c == '$':
+
+    def extra(self, char):
+        memory = self.memory
+        if char == ')':
+            self.stack.append(memory[self.head])
+        elif char == '(':
+            memory[self.head] = self.stack.pop() if self.stack else 0
+        elif char == '@':
+            memory[self.head] = self.stack[-1] if self.stack else 0
+        elif self.stack:
+            value = memory[self.head]  # Computed outside of the tape, which cannot hold overflowing values
+            if char == '$':
                 self.stack.pop()
-            elif c == '=':
-                self.memory[self.head] += self.stack[-1]
-            elif c == '_':
-                self.memory[self.head] -= self.stack[-1]
-            elif c == '}':
-                self.memory[self.head] >>= self.stack[-1]
-            elif c == '{':
-                self.memory[self.head] <<= self.stack[-1]
-            elif c == '|':
-                self.memory[self.head] |= self.stack[-1]
-            elif c == '^':
-                self.memory[self.head] ^= self.stack[-1]
-            elif c == '&':
-                self.memory[self.head] &= self.stack[-1]
-            self.memory[self.head] %= self.CELL_SIZE
-        if c == '+':
-            self.memory[self.head] += 1
-            self.memory[self.head] %= self.CELL_SIZE
-        elif c == '-':
-            self.memory[self.head] -= 1
-            self.memory[self.head] %= self.CELL_SIZE
-        elif c == '>':
-            self.head += 1
-            self.head %= self.MEM_SIZE
-        elif c == '<':
-            self.head -= 1
-            self.head %= self.MEM_SIZE
-        elif c == '.':
-            self.output += chr(self.memory[self.head])
-        elif c == ',':
-            self.memory[self.head] = self.word.read()
-        elif c == '[':
-            if not self.memory[self.head]:
-                nested = 1
-                while nested:
-                    self.code_ptr += 1
-                    if self.code_ptr >= len(self.code):
-                        self.message = _('No matching `]`')
-                        self.state = Interpreter.ERROR
-                        return
-                    if self.code[self.code_ptr] == '[':
-                        nested += 1
-                    if self.code[self.code_ptr] == ']':
-                        nested -= 1
-        elif c == ']':
-            if self.memory[self.head]:
-                nested = 1
-                while nested:
-                    self.code_ptr -= 1
-                    if self.code_ptr < 0:
-                        self.message = _('No matching `[`')
-                        self.state = Interpreter.ERROR
-                        return
-                    if self.code[self.code_ptr] == ']':
-                        nested += 1
-                    if self.code[self.code_ptr] == '[':
-                        nested -= 1
-        elif c == ')':
-            self.stack.append(self.memory[self.head])
-        elif c == '(':
-            self.memory[self.head] = self.stack.pop() if self.stack else 0
-        elif c == '@':
-            self.memory[self.head] = self.stack[-1] if self.stack else 0
-        self.code_ptr += 1
-        if self.code_ptr >= len(self.code):
-            self.state = Interpreter.DONE
-        return True
-        
+            elif char == '=':
+                value += self.stack[-1]
+            elif char == '_':
+                value -= self.stack[-1]
+            elif char == '}':
+                value >>= self.stack[-1]
+            elif char == '{':
+                value <<= self.stack[-1]
+            elif char == '|':
+                value |= self.stack[-1]
+            elif char == '^':
+                value ^= self.stack[-1]
+            elif char == '&':
+                value &= self.stack[-1]
+            memory[self.head] = value % self.CELL_SIZE
+
+
+COMPILED = Cache(*COMPILE_CACHE)
+RESULTS = Cache(*RESULT_CACHE)
 LANGS = {'bf': Brainfuck,
          'stbf': Stacked_Brainfuck}
 
 
+@cog.init
+def start_sandbox():
+    """Start the sandbox worker processes."""
+    global SANDBOX
+    if WORKERS:
+        SANDBOX = Sandbox(WORKERS, MAX_MEMORY, MAX_TIME, MAX_TIME + 1)
+
+
+@cog.exit
+def stop_sandbox():
+    """Stop the sandbox worker processes."""
+    if SANDBOX is not None:
+        SANDBOX.close()
+
+
+def execute(language, code, word):
+    """Run a program and return its (output, state, message, ticks, seconds) result."""
+    return LANGS[language](code, Word(word)).run()
+
+
+def execute_sandboxed(language, code, word):
+    """Run a program in a sandbox worker, see `execute`.
+
+    Return its result along with the compiled programs cache hits and misses it caused,
+    as the worker's cache cannot be seen from the bot process."""
+    hits, misses = COMPILED.hits, COMPILED.misses
+    return execute(language, code, word), COMPILED.hits - hits, COMPILED.misses - misses
+
+
 @cog.command(fulltext=True, flags={'i': 'Specify input'})
-def eso(flags, language, args):
+async def eso(channel, flags, language, args):
     if language not in LANGS:
-        return _('Unknown language, too esoteric')
-    lang = LANGS[language]
+        await channel.send(_('Unknown language, too esoteric'))
+        return
     word, code = '', args
     if 'i' in flags:
         try:
             word, code = args.split(None, 1)
         except ValueError:
-            return 'No input provided'
+            await channel.send('No input provided')
+            return
     word = word.replace('%20', ' ').replace('%27', '%')
     code = code.strip(' \r\n`')
-    interpreter = lang(code, Word(word))
-    output, state, message, ticks, seconds = interpreter.run()
-    output = output.replace('`', '\`')
+    key = (language, code, word)
+    result = RESULTS.get(key)
+    if result is None:
+        if SANDBOX is not None:
+            result = await SANDBOX.run(execute_sandboxed, language, code, word)
+            if result is not None:
+                result, hits, misses = result
+                COMPILED.hits += hits
+                COMPILED.misses += misses
+        else:
+            result = await LANGS[language](code, Word(word)).run_async()
+        if result is None:
+            await channel.send(_('Aborted: time or memory limit exceeded'))
+            return
+        if result[1] in (Interpreter.DONE, Interpreter.ERROR):  # Aborted programs may depend on the load
+            RESULTS.put(key, result, len(code) + len(word) + len(result[0]))
+    output, state, message, ticks, seconds = result
     if len(output) > MAX_SIZE:
-        output = output[:MAX_SIZE] + '**Too long (%d), truncated to %d**' % (len(output), MAX_SIZE)
+        output = output[:MAX_SIZE].replace('`', '\`') + '**Too long, truncated to %d**' % MAX_SIZE
+    else:
+        output = output.replace('`', '\`')
     if state == Interpreter.ERROR:
-        footer = _('Error: ') + message
+        footer = _('Error: ') + (_('No matching `]`') if message == '[' else _('No matching `[`'))
     else:
         footer = _('{finished} in {ticks} ticks ({seconds:.3f}s)').format(
             finished=_('Aborted') if state == Interpreter.ABORT else _('Executed'),
             ticks=ticks, seconds=seconds)
-    return output + '\n' + footer
+    await channel.send(output + '\n' + footer)
+
+
+@cog.command
+def esostats():
+    """Display statistics about the esolang caches."""
+    lines = []
+    for name, cache in ((_('Compiled programs'), COMPILED), (_('Results'), RESULTS)):
+        if cache is COMPILED and SANDBOX is not None:  # Compiled programs are held by the sandbox workers
+            lines.append(_('{name}: {hits} hits, {misses} misses (kept by the sandbox workers)').format(
+                name=name, hits=cache.hits, misses=cache.misses))
+        else:
+            lines.append(_('{name}: {entries} entries ({size} characters), {hits} hits, {misses} misses').format(
+                name=name, entries=len(cache.data), size=cache.size, hits=cache.hits, misses=cache.misses))
+    return '\n'.join(lines)
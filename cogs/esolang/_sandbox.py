@@ -0,0 +1,133 @@
+"""Sandboxed execution of esoteric programs in worker processes.
+
+This module starts with an underscore so that it isn't loaded as a sub-cog."""
+import asyncio
+import logging
+import multiprocessing
+import gearbox
+try:
+    import resource
+except ImportError:  # Not available on Windows, limits are then only enforced by timeouts
+    resource = None
+
+log = logging.getLogger('semi.eso')
+
+
+def limit_memory(size):
+    """Limit the address space of the current process to its current size plus `size` bytes."""
+    if resource is None:
+        return
+    try:
+        with open('/proc/self/statm') as statm:
+            current = int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError):
+        log.warning('Cannot read process memory usage, memory is not limited')
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (current + size, current + size))
+
+
+def limit_cpu(seconds):
+    """Allow the current process to use `seconds` more seconds of CPU time before being killed."""
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def serve(connection, memory):
+    """Worker main loop: receive (function, arguments, cpu) jobs and send back their results."""
+    limit_memory(memory)
+    while True:
+        try:
+            func, args, cpu = connection.recv()
+        except EOFError:  # Parent is gone
+            return
+        limit_cpu(cpu)
+        try:
+            result = func(*args)
+        except MemoryError:
+            result = None
+        connection.send(result)
+
+
+class Worker:
+    """Worker process and its connection."""
+
+    def __init__(self, context, memory):
+        """Initialize and start the process."""
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, memory), daemon=True)
+        self.process.start()
+        child.close()
+
+    def call(self, job, timeout):
+        """Send a job and wait for its result, blocking.
+
+        Return None if the worker was killed, either by a limit or because it timed out."""
+        try:
+            self.connection.send(job)
+            if self.connection.poll(timeout):
+                return self.connection.recv()
+        except (EOFError, OSError):
+            pass
+        self.kill()
+        return None
+
+    def is_alive(self):
+        """Whether or not the worker can still be used."""
+        return self.process.is_alive()
+
+    def kill(self):
+        """Kill the worker process."""
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+class Sandbox:
+    """Pool of pre-started worker processes with CPU and memory limits."""
+
+    def __init__(self, workers, memory, cpu, timeout):
+        """Initialize.
+
+        workers: number of worker processes
+        memory:  memory, in bytes, a worker may allocate
+        cpu:     CPU time, in seconds, a job may use before its worker is killed
+        timeout: time, in seconds, after which a job's worker is killed"""
+        self.context = multiprocessing.get_context('spawn')
+        self.memory = memory
+        self.cpu = cpu
+        self.timeout = timeout
+        self.closed = False
+        self.idle = asyncio.Queue()
+        for _ in range(workers):
+            self.idle.put_nowait(Worker(self.context, memory))
+
+    async def run(self, func, *args):
+        """Call a function in a worker and return its result, or None if the worker had to be killed.
+
+        The function and its arguments must be picklable."""
+        worker = await self.idle.get()
+        try:
+            return await gearbox.run_in_executor('thread', worker.call, (func, args, self.cpu), self.timeout)
+        except asyncio.CancelledError:  # The job goes on in its thread, its worker cannot take another one
+            worker.kill()
+            raise
+        finally:
+            if self.closed:
+                worker.kill()
+            else:
+                if not worker.is_alive():
+                    log.info('Restarting killed esolang worker')
+                    worker = Worker(self.context, self.memory)
+                self.idle.put_nowait(worker)
+
+    def close(self):
+        """Stop all idle workers, busy ones are stopped once they're done."""
+        self.closed = True
+        while not self.idle.empty():
+            self.idle.get_nowait().kill()
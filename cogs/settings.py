@@ -87,6 +87,7 @@ def breaker(guild_ex, command: {'get', 'set'}='get', new_breaker=None):
         if len(new_breaker) != 1:
             return _("The breaker character should be a single character")
         guild_ex.config['breaker'] = new_breaker
+        guild_ex.write()
         return _("The breaker character for this server has been set to `{breaker}`").format(breaker=new_breaker)
 
 
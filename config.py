@@ -23,6 +23,16 @@ DEFAULT_CFG = {
         'reload': True,
     }, 'port': {
         'websocket': 8765
+    }, 'executor': {
+        'thread': 4,
+        'process': 2,
+    }, 'storage': {
+        'backend': 'sqlite',
+        'database': 'data/guilds.db',
+    }, 'attachment': {
+        'max_size': 8388608,
+        'spool_size': 1048576,
+        'chunk_size': 65536,
     }
 }
 
@@ -35,8 +35,11 @@ class Bot(discord.Client):
         self.cogs = {}
         # last time the cogs file were checked for modifications
         self.last_update = time.time()
-        # id:gearbox.Guild mapping of guilds (PMs use the channel ID)
-        self.guilds_ex = {}
+        # storage of guild settings, and id:gearbox.Guild mapping of guilds (PMs use the channel ID)
+        self.store = gearbox.open_store()
+        self.guilds_ex = {sid: gearbox.Guild(sid, self.store, data) for sid, data in self.store.load_all().items()}
+        # bot mentions, used as additional prefixes (known once logged in)
+        self.mentions = None
 
     def get_guild_ex(self, message_or_id):
         """Return an extended guild object from its ID or a message."""
@@ -53,7 +56,7 @@ class Bot(discord.Client):
         else:
             guild_ex_id = message_or_id
         if guild_ex_id not in self.guilds_ex:
-            self.guilds_ex[guild_ex_id] = gearbox.Guild(guild_ex_id, CFG['path']['guild'])
+            self.guilds_ex[guild_ex_id] = gearbox.Guild(guild_ex_id, self.store)
         return self.guilds_ex[guild_ex_id]
 
     def run(self, *args, **kwargs):
@@ -76,14 +79,11 @@ class Bot(discord.Client):
 
         guild_ex = self.get_guild_ex(message)
 
-        # Loading prefixes and breaker settings
-        prefixes = [self.user.mention, self.user.mention.replace('<@', '<@!')]
-        prefixes.extend(guild_ex.prefixes)
-        breaker = guild_ex.config['breaker']
-
-        # Extracting commands
-        commands, command_only = gearbox.read_commands(message.content, prefixes, breaker,
-                                                       isinstance(message.channel, discord.abc.PrivateChannel))
+        # Extracting commands, the reader is compiled once per guild from mentions, prefixes and breaker
+        if self.mentions is None:
+            self.mentions = (self.user.mention, self.user.mention.replace('<@', '<@!'))
+        commands, command_only = guild_ex.get_reader(self.mentions).read(
+            message.content, isinstance(message.channel, discord.abc.PrivateChannel))
 
         for command in commands:
             await self.process(command, command_only, message, guild_ex)
@@ -107,6 +107,8 @@ class Bot(discord.Client):
                 for cog in cogs:
                     cog.on_exit()
                 log.info("All cogs unloaded.")
+                gearbox.shutdown_executors()
+                self.store.close()
                 self.ws_server.close()
                 await self.change_presence(activity=None)
                 await self.logout()
@@ -135,7 +137,7 @@ class Bot(discord.Client):
                     command, matches, guild_ex.config['language']))
             func = matches[0][1] if len(matches) == 1 else None
         if func is not None:
-            await func.call(self, message, arguments, cogs)
+            await func.call(self, message, arguments, cogs, guild_ex)
             if (func.delete_message and command_only and
                     message.channel.permissions_for(
                         message.guild.get_member(self.user.id)).manage_messages):
@@ -149,16 +151,14 @@ class Bot(discord.Client):
     def dispatch(self, event, *args, **kwargs):
         """Override base event dispatch to call cogs event handlers."""
         super().dispatch(event, *args, **kwargs)
-        inferred = None
-        guild_ex = None
-        method = 'on_' + event
-        for cog in cogs:
-            if method in cog.events:
-                if inferred is None:
-                    inferred = gearbox.infer_arguments(args, self, None)
-                    guild_ex = inferred.get('guild_ex')
-                if guild_ex is None or guild_ex.is_allowed(cog.name):
-                    self.loop.create_task(cog.events.get(method).call(self, args, inferred))
+        handlers = cogs.events.get(event)
+        if handlers is None:
+            return
+        context = gearbox.Context(args, self)
+        guild_ex = context.get('guild_ex')
+        for cog, handler in handlers:
+            if guild_ex is None or guild_ex.is_allowed(cog.name):
+                self.loop.create_task(handler.call(self, args, context))
 
     async def wheel(self):  # They see me loading
         """Dynamically update the cogs."""
@@ -211,6 +211,8 @@ class Bot(discord.Client):
                             valid_cogs.add(name)
                 for name in valid_cogs:
                     cogs.cogs.pop(name, None)
+                if valid_cogs:
+                    cogs.update_index()
 
             await asyncio.sleep(2)
 
@@ -1,16 +1,28 @@
 """More like a toolbox, actually."""
+import asyncio
+import concurrent.futures
+import contextvars
+import copy
+import functools
+import importlib
 import inspect
 import logging
+import multiprocessing
 import os
 import re
 import json
+import sqlite3
 import subprocess
 import datetime
+import tempfile
+import threading
+import aiohttp
 import discord
 import yaml
 import config
 import gettext
 import unittest
+import unittest.mock
 
 
 class TestGearbox(unittest.TestCase):
@@ -53,9 +65,112 @@ class TestGearbox(unittest.TestCase):
         self.assertEqual(read_commands("a b ||;c", [';'], '|', False), (['c'], False))
         self.assertEqual(read_commands("a |;b || ;c | ;d", [';'], '|', False), (['b', 'c | ;d'], False))
 
+    def test_command_reader(self):
+        cases = (";a b c", "|;a b|;c", "a b", "a b || c", "a b ||;c", "a |;b || ;c | ;d", "  ;a | b", "!a", "")
+        for prefixes in ([';'], [';', '!'], []):
+            reader = CommandReader(prefixes, '|')
+            for text in cases:
+                self.assertEqual(reader.read(text), read_commands(text, prefixes, '|'))
+            self.assertEqual(reader.read("a b", True), read_commands("a b", prefixes, '|', True))
+
+    def test_stores(self):
+        with tempfile.TemporaryDirectory() as path:
+            json_store = JsonStore(os.path.join(path, 'guilds', '%s.json'))
+            json_store.save(1, {'language': 'fr'})
+            json_store.save(-2, {'prefixes': ['!']})
+            self.assertEqual(json_store.load(1), {'language': 'fr'})
+            self.assertIsNone(json_store.load(3))
+            self.assertEqual(json_store.load_all(), {1: {'language': 'fr'}, -2: {'prefixes': ['!']}})
+            sqlite_store = SQLiteStore(os.path.join(path, 'guilds.db'), json_store)  # Migrates JSON files
+            self.assertEqual(sqlite_store.load_all(), json_store.load_all())
+            sqlite_store.save(1, {'language': 'nl'})
+            sqlite_store.save_many({3: {}, 4: {'breaker': '&'}})
+            sqlite_store.close()
+            sqlite_store = SQLiteStore(os.path.join(path, 'guilds.db'), json_store)  # Does not migrate again
+            self.assertEqual(sqlite_store.load(1), {'language': 'nl'})
+            self.assertEqual(len(sqlite_store.load_all()), 4)
+            sqlite_store.close()
+
+    def test_context(self):
+        self.assertEqual((Context((1, 'a', 2, 'b')).get('before'), Context((1, 'a', 2, 'b')).get('after')), ('a', 'b'))
+        self.assertEqual((Context((1, 2, 3)).get('before'), Context((1, 2, 3)).get('after')), (2, 3))
+        self.assertNotIn('before', Context((1, 'a')))
+        client = unittest.mock.Mock()
+        member = unittest.mock.Mock(spec=discord.Member)
+        message = unittest.mock.Mock(spec=discord.Message, author=member, content='hi', attachments=[])
+        context = Context((message,), client, 'cogs')
+        self.assertIs(context['channel'], message.channel)
+        self.assertIs(context['user'], member)
+        self.assertIs(context['guild'], message.guild)
+        self.assertEqual((context['content'], context['flags'], context['__cogs'], context['attachments']),
+                         ('hi', '', 'cogs', []))
+        self.assertIs(context['permissions'], message.channel.permissions_for.return_value)
+        message.channel.permissions_for.assert_called_once_with(member)
+        self.assertIs(context['guild_ex'], client.get_guild_ex.return_value)
+        client.get_guild_ex.assert_called_once_with(message.guild.id)
+        self.assertNotIn('reaction', context)
+        self.assertNotIn('unknown', context)
+        with self.assertRaises(KeyError):
+            context['private_channel']
+        # Values are only computed when requested
+        context = Context((message,), client)
+        context.get('channel')
+        self.assertNotIn('guild_ex', context.values)
+
+    def test_command_call(self):
+        def command(channel, number: int, color: {'Red', 'Blue'}, flag: bool, flags, text=''):
+            return repr((number, color, flag, flags, text))
+
+        def positional(first: int, *others):
+            return repr((first, others))
+
+        cog = Cog()
+        commands = {name: Command(func, 'ab', fulltext=name == 'command', parent=cog)
+                    for name, func in (('command', command), ('positional', positional))}
+        self.assertEqual(commands['command'].plan, [(Command.CAST, int),
+                                                    (Command.CHOICE, {'red': 'Red', 'blue': 'Blue'}),
+                                                    (Command.BOOL, None), (Command.RAW, None)])
+        self.assertEqual(commands['command'].slots, [(True, 'channel'), (False, 0), (False, 1), (False, 2),
+                                                     (True, 'flags'), (False, 3)])
+        self.assertEqual(commands['positional'].plan, [(Command.CAST, int), (Command.RAW, None)])
+        guild_ex = unittest.mock.Mock(config={'language': 'en'})
+        cases = (('command', '-b 12 blue yes some text', "(12, 'Blue', True, 'b', 'some text')"),
+                 ('command', '-ab 0 RED 0', "(0, 'Red', False, 'ab', '')"),
+                 ('command', '-c 1 red yes', 'Invalid flag: -c'),
+                 ('command', 'x red yes', 'Argument "x" should be of type int'),
+                 ('command', '1 green yes', 'Argument "green" should have one of the following values: '),
+                 ('command', '1 red maybe', 'Argument "maybe" should be of type bool'),
+                 ('command', '1 red', 'Too few arguments, at least 3 expected'),
+                 ('positional', '1 2 3', "(1, ('2', '3'))"),
+                 ('positional', '1', '(1, ())'))
+        for name, arguments, output in cases:
+            message = unittest.mock.Mock(spec=discord.Message)
+            message.channel.send = unittest.mock.AsyncMock()
+            asyncio.run(commands[name].call(unittest.mock.Mock(), message, arguments, guild_ex=guild_ex))
+            self.assertTrue(message.channel.send.call_args[0][0].startswith(output), (arguments, output))
+
+    def test_run_in_executor(self):
+        async def run():
+            event = threading.Event()
+            calls = [asyncio.ensure_future(run_in_executor('thread', event.wait, 1)) for _ in range(3)]
+            await asyncio.sleep(0)
+            self.assertEqual(EXECUTOR_STATS['thread'], {'pending': 3, 'peak': 3, 'done': 0})
+            event.set()
+            self.assertEqual(await asyncio.gather(*calls), [True] * 3)
+            with self.assertRaises(ZeroDivisionError):  # Failed functions are accounted for too
+                await run_in_executor('thread', divmod, 1, 0)
+            self.assertEqual(EXECUTOR_STATS['thread'], {'pending': 0, 'peak': 3, 'done': 4})
+
+        with unittest.mock.patch.dict(CFG, {'executor': {'thread': 1}}), \
+                unittest.mock.patch.dict(EXECUTORS, clear=True), unittest.mock.patch.dict(EXECUTOR_STATS, clear=True):
+            with self.assertLogs(log, logging.WARNING):  # The queue grew longer than the pool
+                asyncio.run(run())
+            shutdown_executors()
+
 
 # List of possible special arguments that a command can expect
-SPECIAL_ARGS = ('message', 'author', 'channel', 'guild', 'guild_ex', 'client', 'flags', '__cogs', 'permissions')
+SPECIAL_ARGS = ('message', 'author', 'channel', 'guild', 'guild_ex', 'client', 'flags', '__cogs', 'permissions',
+                'attachments')
 SPECIAL_TYPES = {discord.Message: 'message', discord.abc.PrivateChannel: 'private_channel',
                  discord.abc.GuildChannel: 'guild_channel', discord.Member: 'member', discord.VoiceState: 'voice_state',
                  discord.User: 'user', discord.Guild: 'guild', discord.Reaction: 'reaction', discord.Emoji: 'emoji',
@@ -65,6 +180,8 @@ CONFIG_LOADERS = {'json': json, 'yaml': yaml}  # name:module mapping of config l
 CFG = {}  # Configuration settings (nested dictionary)
 version = {'num': 'unknown', 'stable': True, 'commits': 0, 'hash': None, 'dirty': False}  # version information
 LANGUAGES = {}  # language_code:translation mapping of all available languages for this module (gearbox)
+EXECUTORS = {}  # name:pool mapping of pools running synchronous commands, created on demand
+EXECUTOR_STATS = {}  # name:{'pending', 'peak', 'done'} mapping of pool usage metrics
 log = logging.getLogger('semi.gear')
 
 
@@ -193,6 +310,55 @@ def read_commands(text, prefixes, breaker, is_private=False):
     return [], False  # No command was found
 
 
+class CommandReader:
+    """Compiled equivalent of `read_commands` for a given set of prefixes and breaker.
+
+    Prefixes are matched with a single regular expression, and text containing
+    neither a prefix nor the breaker is rejected without any allocation."""
+
+    def __init__(self, prefixes, breaker):
+        """Initialize."""
+        self.prefixes = tuple(prefixes)
+        self.breaker = breaker
+        # Alternation keeps the order of prefixes, so the first matching prefix wins like in `strip_prefix`
+        self.pattern = re.compile('|'.join(map(re.escape, self.prefixes))) if self.prefixes else None
+
+    def strip(self, text):
+        """Return the text without its prefix, or None if it has none."""
+        if self.pattern is None:
+            return None
+        match = self.pattern.match(text)
+        if match is None:
+            return None
+        return text[match.end():].lstrip()
+
+    def read(self, text, is_private=False):
+        """Read commands from a string, see `read_commands`."""
+        if is_private:
+            return [strip_prefix(text)], True
+        command = self.strip(text)
+        if command is not None:
+            return [command], True
+        if self.breaker not in text:  # Fast path, most messages end here
+            return [], False
+        commands = []
+        index = text.find(self.breaker * 2)
+        if index >= 0:
+            before, after = text[:index].rstrip(), text[index + 2:].lstrip()
+        else:
+            before, after = text, None
+        if self.breaker in before:
+            for part in before.split(self.breaker):
+                command = self.strip(part.strip())
+                if command is not None:
+                    commands.append(command)
+        if after is not None:
+            command = self.strip(after)
+            if command is not None:
+                commands.append(command)
+        return commands, False
+
+
 def duplicate_command_message(command, matches, language):
     """Simple function returning a localized message for core.py (didn't want a separate translation file)."""
     _ = (lambda s: s) if language not in LANGUAGES else LANGUAGES[language].gettext
@@ -219,88 +385,312 @@ def str_to_chan(guild, channel):
         return None
 
 
-def infer_arguments(given, client=None, _cogs=None):
-    """Return a list of arguments extracted from data."""
-    sent = {}
-    # Handle the before/after arguments for update events
-    for i, arg1 in enumerate(given):
-        for j, arg2 in enumerate(given):
-            if type(arg1) == type(arg2) and i < j:
-                sent['before'] = arg1
-                sent['after'] = arg2
-    # Handle the rest of special arguments
-    special = {}
-    for arg in given:
-        for arg_type, arg_name in SPECIAL_TYPES.items():
-            if isinstance(arg, arg_type):
-                special[arg_name] = arg
-    sent['client'] = client
-    if 'reaction' in special:
-        sent['reaction'] = special['reaction']
-    if 'message' in special:
-        sent['message'] = special['message']
-    elif 'reaction' in special:
-        sent['message'] = special['reaction'].message
-    if 'message' in sent:
-        sent['author'] = sent['message'].author
-        sent['content'] = sent['message'].content
-    if 'guild_channel' in special:
-        sent['guild_channel'] = special['guild_channel']
-        sent['channel'] = special['guild_channel']
-    elif 'private_channel' in special:
-        sent['private_channel'] = special['private_channel']
-        sent['channel'] = special['private_channel']
-    elif 'message' in sent:
-        sent['channel'] = sent['message'].channel
-    if 'member' in special:
-        sent['member'] = special['member']
-    elif 'author' in sent and isinstance(sent['author'], discord.Member):
-        sent['member'] = sent['author']
-    if 'user' in special:
-        sent['user'] = special['user']
-    elif 'member' in sent:
-        sent['user'] = sent['member']
-    elif 'author' in sent:
-        sent['user'] = sent['author']
-    if 'guild' in special:
-        sent['guild'] = special['guild']
-    elif 'message' in sent:
-        sent['guild'] = sent['message'].guild
-    elif 'guild_channel' in sent:
-        sent['guild'] = sent['guild_channel'].guild
-    elif 'member' in sent:
-        sent['guild'] = sent['member'].guild
-    if 'guild' in sent:
-        if 'channel' in sent and isinstance(sent['channel'], discord.abc.PrivateChannel):
-            sent['guild_ex'] = client.get_guild_ex(sent['channel'].id)
+def get_executor(name):
+    """Return the shared pool of a given type ('thread' or 'process'), creating it if needed."""
+    if name not in EXECUTORS:
+        size = CFG['executor'][name]
+        if name == 'process':
+            # Spawned rather than forked, workers must not inherit the event loop and open connections
+            context = multiprocessing.get_context('spawn')
+            EXECUTORS[name] = concurrent.futures.ProcessPoolExecutor(size, mp_context=context)
         else:
-            sent['guild_ex'] = client.get_guild_ex(sent['guild'].id)
-    if 'channel' in sent and 'member' in sent:
-        sent['permissions'] = sent['channel'].permissions_for(sent['member'])
-    sent['flags'] = ''
-    sent['__cogs'] = _cogs
-    return sent
+            EXECUTORS[name] = concurrent.futures.ThreadPoolExecutor(size)
+        log.info("Started %s pool with %d workers", name, size)
+    return EXECUTORS[name]
+
+
+def shutdown_executors():
+    """Shut down all pools, without waiting for running functions."""
+    for name, pool in EXECUTORS.items():
+        log.info("Stopping %s pool (%s)", name, EXECUTOR_STATS.get(name))
+        pool.shutdown(wait=False)
+    EXECUTORS.clear()
+
+
+async def run_in_executor(name, func, *args):
+    """Run a function in a shared pool and await its result, keeping track of the queue depth."""
+    stats = EXECUTOR_STATS.setdefault(name, {'pending': 0, 'peak': 0, 'done': 0})
+    stats['pending'] += 1
+    if stats['pending'] > stats['peak']:
+        stats['peak'] = stats['pending']
+        if stats['peak'] > CFG['executor'][name]:
+            log.warning("%s pool queue reached %d pending functions", name.capitalize(), stats['peak'])
+    try:
+        return await asyncio.get_event_loop().run_in_executor(get_executor(name), functools.partial(func, *args))
+    finally:
+        stats['pending'] -= 1
+        stats['done'] += 1
+
+
+WORKER_COGS = {}  # module_name:mtime mapping of cogs initialized in this process, only used by process pool workers
+
+
+def process_call(cfg, module_name, cog_name, func_name, language, args, kwargs):
+    """Call a cog function inside a process pool worker.
+
+    The cog is imported and initialized the first time, and reloaded if its file changed since."""
+    CFG.update(cfg)
+    module = importlib.import_module(module_name)
+    mtime = os.path.getmtime(module.__file__)
+    if module_name in WORKER_COGS and WORKER_COGS[module_name] != mtime:
+        module = importlib.reload(module)
+    cog = getattr(module, 'cog', None)
+    if isinstance(cog, Cog):
+        if WORKER_COGS.get(module_name) != mtime:
+            cog.name = cog_name
+            cog.load_cfg()
+            cog.on_init()
+        cog.set_lang(language)
+    WORKER_COGS[module_name] = mtime
+    return getattr(module, func_name)(*args, **kwargs)
+
+
+MISSING = object()  # Sentinel for special arguments which cannot be computed from the given data
+
+
+class AttachmentError(Exception):
+    """Raised when an attachment cannot be downloaded."""
+
+
+class AttachmentTooLarge(AttachmentError):
+    """Raised when an attachment is larger than the configured limit."""
+
+
+class Attachment:
+    """Reader of a message attachment, downloaded in chunks as it is read.
+
+    Attachments larger than `attachment.max_size` bytes are never downloaded past that size."""
+
+    def __init__(self, attachment):
+        """Initialize from a discord.Attachment."""
+        self.attachment = attachment
+        self.filename = attachment.filename
+        self.size = attachment.size
+
+    async def chunks(self, size=None):
+        """Download the attachment, yielding chunks of at most `size` bytes (default `attachment.chunk_size`).
+
+        Raise AttachmentTooLarge if it is too large, AttachmentError if the download fails."""
+        limit = CFG['attachment']['max_size']
+        if self.size > limit:
+            raise AttachmentTooLarge(self.filename)
+        total = 0
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(self.attachment.url, raise_for_status=True) as response:
+                    async for chunk in response.content.iter_chunked(size or CFG['attachment']['chunk_size']):
+                        total += len(chunk)
+                        if total > limit:  # The announced size may be wrong
+                            raise AttachmentTooLarge(self.filename)
+                        yield chunk
+        except aiohttp.ClientError as exc:
+            raise AttachmentError(self.filename) from exc
+
+    async def spool(self):
+        """Download the attachment into a temporary file, kept in memory below `attachment.spool_size` bytes.
+
+        Return the file positioned at its start, the caller must close it."""
+        file = tempfile.SpooledTemporaryFile(max_size=CFG['attachment']['spool_size'])
+        try:
+            async for chunk in self.chunks():
+                file.write(chunk)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+    async def read(self):
+        """Download the whole attachment and return its content."""
+        return b''.join([chunk async for chunk in self.chunks()])
+
+
+class Context:
+    """Special arguments extracted from event or command data, computed lazily.
+
+    Each value is only computed the first time it is requested, which means a
+    callable pays only for the special arguments it actually declares."""
+
+    # Names of all the values a context can provide
+    FIELDS = frozenset(('before', 'after', 'client', 'reaction', 'message', 'author', 'content', 'guild_channel',
+                        'private_channel', 'channel', 'member', 'user', 'guild', 'guild_ex', 'permissions',
+                        'flags', '__cogs', 'attachments'))
+
+    def __init__(self, given, client=None, _cogs=None):
+        """Initialize."""
+        self.given = given
+        # name:value mapping of computed values, MISSING if they cannot be computed
+        self.values = {'client': client, 'flags': '', '__cogs': _cogs}
+        self._special = None
+
+    @property
+    def special(self):
+        """name:object mapping of given objects, detected with SPECIAL_TYPES."""
+        if self._special is None:
+            self._special = {}
+            for arg in self.given:
+                for arg_type, arg_name in SPECIAL_TYPES.items():
+                    if isinstance(arg, arg_type):
+                        self._special[arg_name] = arg
+        return self._special
+
+    def resolve(self, name):
+        """Return the value of a special argument, or MISSING if it cannot be computed."""
+        try:
+            return self.values[name]
+        except KeyError:
+            pass
+        value = getattr(self, '_' + name)() if name in Context.FIELDS else MISSING
+        self.values[name] = value
+        return value
+
+    def get(self, name, default=None):
+        """Return the value of a special argument, or `default` if it cannot be computed."""
+        value = self.resolve(name)
+        return default if value is MISSING else value
+
+    def __contains__(self, name):
+        return self.resolve(name) is not MISSING
+
+    def __getitem__(self, name):
+        value = self.resolve(name)
+        if value is MISSING:
+            raise KeyError(name)
+        return value
+
+    def _update_pair(self):
+        """Handle the before/after arguments for update events.
+
+        They are the last pair of arguments of the same type, in order of their first then second argument."""
+        before = after = MISSING
+        for i, arg1 in enumerate(self.given):
+            for arg2 in self.given[i + 1:]:
+                if type(arg1) == type(arg2):
+                    before, after = arg1, arg2
+        self.values['before'] = before
+        self.values['after'] = after
+
+    def _before(self):
+        self._update_pair()
+        return self.values['before']
+
+    def _after(self):
+        self._update_pair()
+        return self.values['after']
+
+    def _reaction(self):
+        return self.special.get('reaction', MISSING)
+
+    def _message(self):
+        if 'message' in self.special:
+            return self.special['message']
+        if 'reaction' in self.special:
+            return self.special['reaction'].message
+        return MISSING
+
+    def _author(self):
+        message = self.resolve('message')
+        return MISSING if message is MISSING else message.author
+
+    def _content(self):
+        message = self.resolve('message')
+        return MISSING if message is MISSING else message.content
+
+    def _guild_channel(self):
+        return self.special.get('guild_channel', MISSING)
+
+    def _private_channel(self):
+        if 'guild_channel' in self.special:
+            return MISSING
+        return self.special.get('private_channel', MISSING)
+
+    def _channel(self):
+        if 'guild_channel' in self.special:
+            return self.special['guild_channel']
+        if 'private_channel' in self.special:
+            return self.special['private_channel']
+        message = self.resolve('message')
+        return MISSING if message is MISSING else message.channel
+
+    def _member(self):
+        if 'member' in self.special:
+            return self.special['member']
+        author = self.resolve('author')
+        return author if isinstance(author, discord.Member) else MISSING
+
+    def _user(self):
+        if 'user' in self.special:
+            return self.special['user']
+        member = self.resolve('member')
+        return member if member is not MISSING else self.resolve('author')
+
+    def _guild(self):
+        if 'guild' in self.special:
+            return self.special['guild']
+        message = self.resolve('message')
+        if message is not MISSING:
+            return message.guild
+        if 'guild_channel' in self.special:
+            return self.special['guild_channel'].guild
+        member = self.resolve('member')
+        return MISSING if member is MISSING else member.guild
+
+    def _guild_ex(self):
+        guild = self.resolve('guild')
+        if guild is MISSING:
+            return MISSING
+        channel = self.resolve('channel')
+        client = self.values['client']
+        if channel is not MISSING and isinstance(channel, discord.abc.PrivateChannel):
+            return client.get_guild_ex(channel.id)
+        return client.get_guild_ex(guild.id)
+
+    def _permissions(self):
+        channel = self.resolve('channel')
+        member = self.resolve('member')
+        if channel is MISSING or member is MISSING:
+            return MISSING
+        return channel.permissions_for(member)
+
+    def _attachments(self):
+        message = self.resolve('message')
+        return MISSING if message is MISSING else [Attachment(attachment) for attachment in message.attachments]
 
 
 class Callable:
     """Wrapper of commodity methods common to callable objects."""
 
-    def __init__(self, func):
+    # Types of pools a synchronous callable can be executed in
+    EXECUTORS = ('thread', 'process')
+
+    def __init__(self, func, executor=None, parent=None):
         self.func = func
+        # Parent cog
+        self.parent = parent
+        # Pool the function is executed in, None to execute it directly on the event loop
+        if executor is not None and executor not in Callable.EXECUTORS:
+            log.error("Invalid executor '%s' for function %s", executor, func.__name__)
+            executor = None
+        if executor is not None and inspect.iscoroutinefunction(func):
+            log.warning("Coroutine %s cannot be executed in a %s pool", func.__name__, executor)
+            executor = None
+        self.executor = executor
         # Argument list
         self.args = list(inspect.signature(func).parameters)
+        # Arguments which may be provided by a Context, the only ones it will compute
+        self.context_args = frozenset(arg for arg in self.args if arg in Context.FIELDS)
         # Whether or not the function is a coroutine (and shall be awaited)
         self.is_coroutine = inspect.iscoroutinefunction(func)
 
-    def get_arguments(self, given, client=None, *, inferred=None):
+    def get_arguments(self, given, client=None, *, context=None):
         """Rearrange arguments to be passed directly to the callable."""
-        if inferred is None:
-            inferred = infer_arguments(given, client=client)
+        if context is None:
+            context = Context(given, client)
         index = 0
         result = []
         for arg in self.args:
-            if arg in inferred:
-                result.append(inferred.get(arg))
+            if arg in self.context_args and arg in context:
+                result.append(context.get(arg))
             else:
                 result.append(given[index])
                 index += 1
@@ -311,10 +701,21 @@ class Callable:
         if self.is_coroutine:
             await self.func(*args, **kwargs)
         else:
-            output = self.func(*args, **kwargs)
+            if self.executor == 'process':  # Functions and arguments are pickled, the function is found by name
+                language = self.parent.language if self.parent is not None else None
+                output = await run_in_executor('process', process_call, CFG, self.func.__module__,
+                                               self.parent.name if self.parent is not None else None,
+                                               self.func.__name__, language, args, kwargs)
+            elif self.executor == 'thread':  # Run in a copy of the context, which holds the guild's language
+                output = await run_in_executor('thread', contextvars.copy_context().run,
+                                               functools.partial(self.func, **kwargs), *args)
+            else:
+                output = self.func(*args, **kwargs)
             if output is not None:
                 if isinstance(output, discord.Embed):  # If the output is an embed, send it as such
                     await channel.send(embed=output)
+                elif isinstance(output, discord.File):  # Files are uploaded
+                    await channel.send(file=output)
                 else:
                     try:  # If the output can be casted to a string, send it to Discord
                         output = str(output)
@@ -337,15 +738,23 @@ class Command(Callable):
     FULL_TEXT = 1  # Expecting a string with possible spaces as last argument, put text as is
     POSITIONAL = 2  # Expecting multiple arguments, send array with them
 
+    # Constants for the conversion applied to each argument, depending on its type hint
+    RAW = 0  # No type hint, argument is sent as is
+    CAST = 1  # Type hint is a type, cast to it
+    BOOL = 2  # Type hint is bool, custom casting
+    CHOICE = 3  # Type hint is a set of strings, argument must be one of them
+    PATTERN = 4  # Type hint is a compiled regex, argument must match it
+    BOOL_VALUES = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
     def __init__(self, func, flags='', *, fulltext=False, delete_message=False, permissions=None,
-                 parent=None, fallback=None):
+                 parent=None, fallback=None, executor=None):
         """Initialize."""
-        super().__init__(func)
+        super().__init__(func, executor, parent)
         # Command arguments as expected by the actual function
         self.params = inspect.signature(func).parameters
         # Command arguments as received from the message
         self.arguments = [arg for arg in self.params if arg not in SPECIAL_ARGS]
-        if self.arguments and self.params[self.arguments[-1]].kind.name is 'VAR_POSITIONAL':
+        if self.arguments and self.params[self.arguments[-1]].kind == inspect.Parameter.VAR_POSITIONAL:
             self.last_arg_mode = Command.POSITIONAL
         elif fulltext:
             self.last_arg_mode = Command.FULL_TEXT
@@ -357,7 +766,7 @@ class Command(Callable):
         # Minimum argument count
         self.min_arg = len([arg for arg, val in self.params.items()
                             if arg not in SPECIAL_ARGS and isinstance(val.default, type) and
-                            self.params[arg].kind.name is not 'VAR_POSITIONAL'])
+                            self.params[arg].kind != inspect.Parameter.VAR_POSITIONAL])
         # Permissions, can be indicated as a string, (string, bool) tuple, or array of any
         # Ends up being stored as an array of (string, bool) tuples
         self.permissions = []
@@ -392,6 +801,15 @@ class Command(Callable):
                         log.warning("Invalid annotation tuple for argument %s in function %s", key, func.__name__)
                 else:
                     log.warning("Invalid annotation type for argument %s in function %s", key, func.__name__)
+        # Parse plan, compiled once so that calls don't have to inspect type hints
+        # (conversion, data) tuple for each argument, positional arguments are never converted
+        self.plan = [self._compile(self.annotations[arg][0]) for arg in self.arguments]
+        if self.last_arg_mode == Command.POSITIONAL:
+            self.plan[-1] = (Command.RAW, None)
+        self.max_args = len(self.arguments)
+        # (is_special, name or argument index) tuple for each parameter, in the order the function expects them
+        self.slots = [(True, key) if key in SPECIAL_ARGS else (False, self.arguments.index(key))
+                      for key, param in self.params.items() if param.kind != inspect.Parameter.VAR_POSITIONAL]
         # Generate empty docstring if none is present
         if not func.__doc__:
             func.__doc__ = ' '
@@ -399,39 +817,55 @@ class Command(Callable):
         self.delete_message = delete_message
         # Function to be called
         self.func = func
-        # Parent cog
-        self.parent = parent
         # In case of denied permission, name of the fallback command - must be a string
         self.fallback = fallback
 
+    @staticmethod
+    def _compile(argtype):
+        """Return the (conversion, data) tuple matching a type hint."""
+        if argtype is None:
+            return Command.RAW, None
+        if argtype is bool:
+            return Command.BOOL, None
+        if isinstance(argtype, type):
+            return Command.CAST, argtype
+        if isinstance(argtype, set):  # Lowercase value:expected value mapping
+            return Command.CHOICE, {value.lower(): value for value in argtype}
+        return Command.PATTERN, argtype
+
+    def split(self, arguments):
+        """Split the argument string into at most as many strings as expected arguments."""
+        return arguments.split(None, self.max_args - 1)
+
     def allows(self, permissions):
         """Determine if a command can be called by someone having certain permissions."""
         if permissions is None or self.permissions is None:
             return True
         return all([permission in permissions for permission in self.permissions])
 
-    async def call(self, client, message, arguments, _cogs=None):
+    async def call(self, client, message, arguments, _cogs=None, guild_ex=None):
         """Call a command."""
-        # Compute values of special arguments
-        special_args = infer_arguments((message,), client, _cogs)
-        assert [arg in SPECIAL_ARGS for arg in special_args] and [arg in special_args for arg in SPECIAL_ARGS]
+        # Special arguments are only computed if the command expects them
+        context = Context((message,), client, _cogs)
+        if guild_ex is not None:  # Already known by the caller
+            context.values['guild_ex'] = guild_ex
         # Get translation function for error messages, according to guild settings
-        language = special_args['guild_ex'].config['language']
+        language = context['guild_ex'].config['language']
         _ = (lambda s: s) if language not in LANGUAGES else LANGUAGES[language].gettext
         # Strip flags from the list of arguments
+        flags = ''
         while arguments.startswith('-') and self.flags:
-            for flag in arguments.split(' ')[0][1:]:
+            word, _sep, arguments = arguments.partition(' ')
+            for flag in word[1:]:
                 if flag != '-':
                     if flag not in self.flags:
                         await message.channel.send(_('Invalid flag: -{flag}').format(flag=flag))
                         return
-                    special_args['flags'] += flag
-            arguments = arguments[arguments.find(' ') + 1:] if ' ' in arguments else ''
+                    flags += flag
         # Extract arguments from message
         pos_args = []  # Positional arguments, none by default
-        args = {key: value for key, value in special_args.items() if key in self.params}
-        max_args = len(self.arguments)
-        text = arguments.split(None, max_args - 1)
+        max_args = self.max_args
+        text = self.split(arguments)
         # Display errors in case of invalid argument count
         if len(text) < self.min_arg:
             await message.channel.send(_('Too few arguments, at least {min_arg_count} expected')
@@ -448,46 +882,49 @@ class Command(Callable):
         if len(text) == max_args and self.last_arg_mode == Command.POSITIONAL:
             pos_args = text[-1].split()
             text = text[:-1]
-        # Type checking code
-        temp_args = {key: text[i] for i, key in enumerate(self.arguments) if i < len(text)}
-        for key, arg in temp_args.items():
-            argtype = self.annotations[key][0]
-            # Check type for all annotated parameters, unless positional
-            if argtype is not None and not(self.last_arg_mode == Command.POSITIONAL and self.arguments[-1] == key):
-                if isinstance(argtype, type):  # If a certain type is expected, cast to it
-                    try:
-                        if argtype is bool:  # Custom casting for booleans
-                            if arg.lower() not in ('true', 'yes', '1', 'false', 'no', '0'):
-                                raise ValueError
-                            temp_args[key] = arg.lower() in ('true', 'yes', '1')
-                        else:  # Regular casting for all other types
-                            temp_args[key] = self.annotations[key][0](arg)
-                    except ValueError:
-                        await message.channel.send(_('Argument "{arg}" should be of type {typename}').format(
-                                                     arg=arg, typename=argtype.__name__))
-                        return
-                elif isinstance(argtype, set):  # Checking if the argument has one of the required values
-                    if arg.lower() not in {value.lower() for value in argtype}:  # Name doesn't match (case insensitive)
-                        await message.channel.send(_('Argument "{arg}" should have one of the following values: {values}').format(
-                                                     arg=arg, values=pretty(argtype, '`%s`', _('or'))))
-                        return
-                    elif arg not in argtype:  # If only the case isn't matching, convert to expected case
-                        for value in argtype:
-                            if arg.lower() == value.lower():
-                                temp_args[key] = value
-                                break
-                else:  # argtype is re.compile
-                    if argtype.match(arg) is None:  # Checking that the argument matches the expected pattern
-                        await message.channel.send(_('Argument "{arg}" should match the following regex: `{pattern}`').format(
-                                                     arg=arg, pattern=argtype.pattern))
-                        return
-        # Update after type checking
-        args.update(temp_args)
+        # Type checking code, following the parse plan
+        values = []
+        for arg, (conversion, data) in zip(text, self.plan):
+            if conversion == Command.CAST:
+                try:
+                    arg = data(arg)
+                except ValueError:
+                    await message.channel.send(_('Argument "{arg}" should be of type {typename}').format(
+                                                 arg=arg, typename=data.__name__))
+                    return
+            elif conversion == Command.BOOL:
+                try:
+                    arg = Command.BOOL_VALUES[arg.lower()]
+                except KeyError:
+                    await message.channel.send(_('Argument "{arg}" should be of type {typename}').format(
+                                                 arg=arg, typename=bool.__name__))
+                    return
+            elif conversion == Command.CHOICE:
+                try:  # Case insensitive match, converted to the expected case
+                    arg = data[arg.lower()]
+                except KeyError:
+                    await message.channel.send(_('Argument "{arg}" should have one of the following values: {values}').format(
+                                                 arg=arg, values=pretty(list(data.values()), '`%s`', _('or'))))
+                    return
+            elif conversion == Command.PATTERN:
+                if data.match(arg) is None:  # Checking that the argument matches the expected pattern
+                    await message.channel.send(_('Argument "{arg}" should match the following regex: `{pattern}`').format(
+                                                 arg=arg, pattern=data.pattern))
+                    return
+            values.append(arg)
         # Sort arguments into expected order
-        ordered_args = [args[key] for key in self.params if key in args]
+        ordered_args = []
+        for is_special, key in self.slots:
+            if is_special:
+                if key == 'flags':
+                    ordered_args.append(flags)
+                elif key in context:
+                    ordered_args.append(context.get(key))
+            elif key < len(values):
+                ordered_args.append(values[key])
         ordered_args += pos_args
         # Update language settings for parent cog (localization)
-        self.parent.set_lang(special_args['guild_ex'].config['language'])
+        self.parent.set_lang(language)
         await self.exec(client, message.channel, *ordered_args)
 
 
@@ -496,10 +933,10 @@ class Event(Callable):
     def __init__(self, func):
         super().__init__(func)
 
-    def call(self, client, args, inferred, channel=None):
-        if channel is None and 'channel' in inferred:
-            channel = inferred['channel']
-        return self.exec(client, channel, *self.get_arguments(args, client=client, inferred=inferred))
+    def call(self, client, args, context, channel=None):
+        if channel is None:
+            channel = context.get('channel')
+        return self.exec(client, channel, *self.get_arguments(args, client=client, context=context))
 
 
 class Cog:
@@ -532,8 +969,11 @@ class Cog:
         self.config_type = config
         # language_code:translation mapping of available languages for this cog
         self.languages = {}
-        # current language
-        self.lang = None
+        # (translation, language code) of the current language, per context: each event is handled in its own task,
+        # so concurrent commands from guilds with different languages (and the threads they use) don't mix them up
+        self.current_lang = contextvars.ContextVar('lang')
+        # (translation, language code) used by contexts which didn't set a language
+        self.default_lang = (None, None)
         # bytestring:commands(array) mapping of which commands should be called when receiving specific data
         self.socket_data = {}
 
@@ -556,7 +996,7 @@ class Cog:
         self.languages = {lang: gettext.translation(os.path.join(*self.name.split('.')),
                                                     localedir=CFG['path']['locale'], languages=[lang])
                           for lang in available_languages}
-        self.set_lang('en')
+        self.default_lang = (self.languages.get('en', None), 'en')
         # Get config loader and path, and read the file
         module, path = self._get_cfg()
         if module is not None:
@@ -695,9 +1135,19 @@ class Cog:
         return {name: self.get(name, permissions) for name, command in self.commands.items()
                 if self.has(name, permissions) and name not in self.hidden}
 
+    @property
+    def lang(self):
+        """Translation of the current language, None if not available."""
+        return self.current_lang.get(self.default_lang)[0]
+
+    @property
+    def language(self):
+        """Code of the current language."""
+        return self.current_lang.get(self.default_lang)[1]
+
     def set_lang(self, lang):
-        """Change the current language. Used for per-guild localization."""
-        self.lang = self.languages.get(lang, None)
+        """Change the current language in the current context. Used for per-guild localization."""
+        self.current_lang.set((self.languages.get(lang, None), lang))
 
     def gettext(self, text):
         """`gettext` wrapper for the current language."""
@@ -714,18 +1164,137 @@ class Cog:
         return self.lang.ngettext(singular, plural, n)
 
 
+class JsonStore:
+    """Guild settings stored in one JSON file per guild."""
+
+    def __init__(self, path):
+        """Initialize, `path` being the path of a guild's file with `%s` standing for its ID."""
+        self.path = path
+
+    @classmethod
+    def open(cls):
+        """Open the store described in the configuration."""
+        return cls(CFG['path']['guild'])
+
+    def load(self, sid):
+        """Return the settings of a guild, or None if it has none."""
+        try:
+            with open(self.path % sid) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def load_all(self):
+        """Return a guild_id:settings mapping of all stored guilds."""
+        folder, name = os.path.split(self.path)
+        folder = folder or '.'
+        if not os.path.isdir(folder):
+            return {}
+        prefix, suffix = name.split('%s')
+        pattern = re.compile(re.escape(prefix) + '(-?[0-9]+)' + re.escape(suffix) + '$')
+        guilds = {}
+        for file in os.listdir(folder):
+            match = pattern.match(file)
+            if match:
+                guilds[int(match.group(1))] = self.load(match.group(1))
+        return guilds
+
+    def save(self, sid, data):
+        """Store the settings of a guild."""
+        os.makedirs(os.path.dirname(self.path % sid) or '.', exist_ok=True)
+        with open(self.path % sid, 'w') as file:
+            json.dump(data, file)
+
+    def save_many(self, guilds):
+        """Store the settings of several guilds, from a guild_id:settings mapping."""
+        for sid, data in guilds.items():
+            self.save(sid, data)
+
+    def close(self):
+        """Release resources used by the store."""
+
+
+class SQLiteStore:
+    """Guild settings stored as JSON documents in a SQLite database.
+
+    When the database is created, settings found by a JsonStore are imported into it."""
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path, migrate_from=None):
+        """Initialize, `path` being the database path and `migrate_from` an optional JsonStore."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')  # Readers don't block the writer
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent without syncing every commit
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS guilds (id INTEGER PRIMARY KEY, config TEXT NOT NULL)')
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] < SQLiteStore.SCHEMA_VERSION:
+            if migrate_from is not None:
+                guilds = migrate_from.load_all()
+                self.save_many(guilds)
+                log.info("Imported %d guilds into the settings database", len(guilds))
+            self.connection.execute('PRAGMA user_version=%d' % SQLiteStore.SCHEMA_VERSION)
+
+    @classmethod
+    def open(cls):
+        """Open the store described in the configuration, importing guilds stored as JSON files."""
+        return cls(CFG['storage']['database'], JsonStore.open())
+
+    def load(self, sid):
+        """Return the settings of a guild, or None if it has none."""
+        row = self.connection.execute('SELECT config FROM guilds WHERE id = ?', (sid,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def load_all(self):
+        """Return a guild_id:settings mapping of all stored guilds."""
+        return {sid: json.loads(data) for sid, data in self.connection.execute('SELECT id, config FROM guilds')}
+
+    def save(self, sid, data):
+        """Store the settings of a guild."""
+        self.save_many({sid: data})
+
+    def save_many(self, guilds):
+        """Store the settings of several guilds, from a guild_id:settings mapping."""
+        with self.connection:  # Single transaction, committed or rolled back as a whole
+            self.connection.executemany('INSERT OR REPLACE INTO guilds (id, config) VALUES (?, ?)',
+                                        [(sid, json.dumps(data)) for sid, data in guilds.items()])
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+
+STORES = {'json': JsonStore, 'sqlite': SQLiteStore}  # name:class mapping of guild settings storage backends
+
+
+def open_store():
+    """Open the guild settings store selected in the configuration."""
+    return STORES[CFG['storage']['backend']].open()
+
+
 class Guild:
     """Custom guild class, used to store additional information."""
     default_cfg = {'cogs': {'blacklist': []}, 'language': 'en', 'timezone': 'UTC', 'prefixes': [';'], 'breaker': '|'}
 
-    def __init__(self, sid, path):
-        """Initialize."""
+    def __init__(self, sid, store, data=None):
+        """Initialize.
+
+        sid:   guild ID (or channel ID for private channels)
+        store: settings storage, like JsonStore or SQLiteStore
+        data:  stored settings, if already loaded"""
         self.id = sid
-        self.path = path % sid
+        self.store = store
         self.config = None
         self.blacklist = None
         self.prefixes = None
-        self.load()
+        # incremented whenever settings are loaded or written, used to invalidate cached data
+        self.version = 0
+        # compiled CommandReader and the (version, mentions) it was built for
+        self.reader = None
+        self.reader_key = None
+        self.load(data)
 
     def is_allowed(self, cog_name):
         """Whether or not a cog can be used on the guild."""
@@ -735,23 +1304,33 @@ class Guild:
             return False
         return True
 
-    def load(self):
-        """Load guild-specific configuration file, create default if non-existent."""
-        try:
-            self.config = {}
-            self.config.update(Guild.default_cfg)
-            config.merge(self.config, json.load(open(self.path)))
-        except FileNotFoundError:
-            self.config = Guild.default_cfg
+    def get_reader(self, mentions=()):
+        """Return a CommandReader for the guild prefixes, preceded by the given mentions."""
+        key = (self.version, mentions)
+        if self.reader is None or self.reader_key != key:
+            self.reader = CommandReader(list(mentions) + self.prefixes, self.config['breaker'])
+            self.reader_key = key
+        return self.reader
+
+    def load(self, data=None):
+        """Load guild-specific configuration, create default if non-existent."""
+        if data is None:
+            data = self.store.load(self.id)
+        self.config = copy.deepcopy(Guild.default_cfg)  # Nested values must not be shared between guilds
+        if data is None:
             self._write()
+        else:
+            config.merge(self.config, data)
         self.blacklist = self.config['cogs']['blacklist']
         self.prefixes = self.config['prefixes']
+        self.version += 1
 
     def write(self):
-        """Write guild-specific configuration file."""
+        """Write guild-specific configuration."""
         self.config['cogs']['blacklist'] = self.blacklist
         self.config['prefixes'] = self.prefixes
+        self.version += 1
         self._write()
 
     def _write(self):
-        json.dump(self.config, open(self.path, 'w'))
+        self.store.save(self.id, self.config)